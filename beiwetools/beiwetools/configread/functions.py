@@ -3,8 +3,9 @@
 '''
 import os
 import logging
+import numpy as np
 from collections import OrderedDict
-from beiwetools.helpers.time import convert_seconds, day_order
+from beiwetools.helpers.time import convert_seconds_array, day_order
 from beiwetools.helpers.functions import read_json
 
 
@@ -41,6 +42,24 @@ def load_settings(settings_list, settings_from_json):
     return(settings)    
         
         
+def decode_timings(timings):
+    '''
+    Convert survey timings to clock times, for all days at once.
+
+    Args:
+        timings (list):  Timings from a JSON file; seven lists of seconds of the day.
+
+    Returns:
+        clock_times (list):  Seven lists of clock times formatted as '%H:%M'.
+    '''
+    counts = [len(t) for t in timings]
+    flat = [s for t in timings for s in t]
+    times = list(convert_seconds_array(flat))
+    ends = np.cumsum(counts)
+    clock_times = [times[e - c:e] for c, e in zip(counts, ends)]
+    return(clock_times)
+
+
 def load_timings(timings, abbreviate = True):
     '''
     Read survey timings.
@@ -53,13 +72,10 @@ def load_timings(timings, abbreviate = True):
         readable (OrderedDict):  
     '''
     readable = OrderedDict()
+    clock_times = decode_timings(timings)
     for i in range(7):
-        t = []
-        for j in range(len(timings[i])):
-            s = timings[i][j]
-            t.append(convert_seconds(s))
         if abbreviate:
-            readable[day_order[i][0:3]] = t
+            readable[day_order[i][0:3]] = clock_times[i]
         else:
-            readable[day_order[i]] = t            
-    return(readable)
\ No newline at end of file
+            readable[day_order[i]] = clock_times[i]
+    return(readable)
@@ -4,13 +4,17 @@ Miscellaneous classes for working with Beiwe data and study configurations.
 import os
 import logging
 import datetime
+import threading
 import textwrap
 import numpy as np
 import pandas as pd
 from collections import OrderedDict
-from .time import local_time_format
+from .time import (local_time_format, day_order, get_holidays, between_days,
+                   get_timezones, to_local_ms, hour_ms, day_ms)
+from .process import read_raw, read_merged, filter_filepaths, open_raw
 from .functions import (write_string, setup_directories, 
-                        setup_csv, write_to_csv, check_same)
+                        setup_csv, write_to_csv, check_same,
+                        write_json, read_json)
 
 
 logger = logging.getLogger(__name__)
@@ -348,9 +352,102 @@ class WriteQueue():
         self.line_count += 1
         
     
+class CategoryCodes():
+    '''
+    Project-wide dictionary of integer codes for string columns with many repeated values,
+    e.g. hashed MAC addresses, SSIDs, or event names.
+    Categories are only ever appended, so a value has the same code in every file, 
+    every read, and every user.
+    Use with readers to load these columns as pandas categoricals.
+
+    Args:
+        columns (list): Names of columns to encode.
+        categories (dict): Optional.  
+            Keys are column names, values are lists of known categories, in order of code.
+
+    Attributes:
+        columns (list): Same as args.
+        categories (OrderedDict): Keys are column names, values are lists of categories.
+        lookup (dict): Keys are column names, values are dictionaries of codes for each category.
+        dtypes (dict): Keys are column names, values are pandas CategoricalDtype objects.
+        lock (threading.Lock): Makes updates safe when reading with multiple threads.
+    '''
+    def __init__(self, columns, categories = {}):
+        self.columns = list(columns)
+        self.categories = OrderedDict()
+        self.lookup = {}
+        self.dtypes = {}
+        self.lock = threading.Lock()
+        for c in self.columns:
+            self.categories[c] = []
+            self.lookup[c] = {}
+            self.extend(c, categories.get(c, []))
+
+    def extend(self, column, values):
+        '''
+        Add new categories for a column.  Values that are already known are ignored.
+        '''
+        new = [v for v in values if not v in self.lookup[column]]
+        if len(new) > 0 or not column in self.dtypes:
+            for v in new:
+                self.lookup[column][v] = len(self.categories[column])
+                self.categories[column].append(v)
+            self.dtypes[column] = pd.CategoricalDtype(self.categories[column])
+
+    def encode(self, df):
+        '''
+        Convert string columns of a dataframe to categoricals with project-wide codes.
+        Only the unique values of each column are looked up;
+        rows are recoded with integer indexing.
+
+        Args:
+            df (DataFrame): A dataframe.  Columns that aren't in self.columns are ignored.
+
+        Returns:
+            None
+        '''
+        for c in self.columns:
+            if c in df.columns:
+                values = df[c]
+                if not isinstance(values.dtype, pd.CategoricalDtype):
+                    values = values.astype('category')
+                local = list(values.cat.categories)
+                with self.lock:
+                    self.extend(c, local)
+                    recode = np.array([self.lookup[c][v] for v in local] + [-1], dtype = np.int64)
+                    dtype = self.dtypes[c]
+                codes = recode[values.cat.codes.to_numpy()]
+                df[c] = pd.Categorical.from_codes(codes, dtype = dtype)
+
+    def align(self, df):
+        '''
+        Update encoded columns to the current list of categories, e.g. before concatenating dataframes.
+        Codes don't change, so this doesn't require any lookups.
+        '''
+        for c in self.columns:
+            if c in df.columns and isinstance(df[c].dtype, pd.CategoricalDtype):
+                with self.lock: dtype = self.dtypes[c]
+                df[c] = pd.Categorical.from_codes(df[c].cat.codes.to_numpy(), dtype = dtype)
+
+    def save(self, directory, name = 'category_codes'):
+        '''
+        Save categories to a json file.
+        '''
+        write_json(self.categories, name, directory)
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Load categories from a json file created by save().
+        '''
+        categories = read_json(path)
+        return(cls(list(categories.keys()), categories))
+
+
 class ReadQueue():
     '''
     Manager for reading multiple CSVs that contain contiguous data.  Delivers CSVs in chunks.
+    CSVs may be compressed (.csv.gz, .csv.zst).
     Use this class to avoid reading arbitrarily many CSVs at a time, 
     e.g. when a data processing task requires reading two or more contiguous files at a time.
 
@@ -363,16 +460,41 @@ class ReadQueue():
             Only matters if return_as == "lines".
             Ignore the first line of each CSV.
         chunk_size (int): How many files to deliver at a time.
+        columns (list or Nonetype): 
+            Only matters if return_as == "dataframe".
+            Names of columns to read.  If None, all columns are read.
+        time_range (list or Nonetype): 
+            Optional ordered pair of millisecond timestamps [start, end].
+            Files that don't overlap [start, end) are dropped from filepaths.
+            If return_as == "dataframe", rows outside of [start, end) are also dropped.
+        codes (CategoryCodes or Nonetype): 
+            Only matters if return_as == "dataframe".
+            If not None, string columns in codes.columns are read as categoricals.
+        raw_dirs (list or Nonetype): 
+            Only matters if return_as == "dataframe".
+            If not None, all copies of each file in raw_dirs are read and merged row by row.
+            See process.read_merged().
+        cache_dir (str or Nonetype): 
+            Optional directory for merged copies of files.  See process.read_merged().
         
     Attributes:
         Same as Args.        
     '''
     def __init__(self, filepaths, return_as = 'dataframe', 
-                 ignore_header = True, chunk_size = 1):
+                 ignore_header = True, chunk_size = 1,
+                 columns = None, time_range = None, codes = None,
+                 raw_dirs = None, cache_dir = None):
+        if not time_range is None:
+            filepaths = filter_filepaths(filepaths, time_range)
         self.filepaths = filepaths
         self.return_as = return_as
         self.ignore_header = ignore_header
         self.chunk_size = chunk_size        
+        self.columns = columns
+        self.time_range = time_range
+        self.codes = codes
+        self.raw_dirs = raw_dirs
+        self.cache_dir = cache_dir
                 
     def get(self):
         '''
@@ -388,7 +510,7 @@ class ReadQueue():
             if self.return_as == 'lines':
                 lines = []
                 for p in temp:
-                    f = open(p, 'r')
+                    f = open_raw(p)
                     new_lines = list(f)
                     if self.ignore_header: new_lines = new_lines[1:]
                     lines += new_lines
@@ -400,6 +522,275 @@ class ReadQueue():
             elif self.return_as == 'dataframe':
                 dataframes = []
                 for p in temp:
-                    dataframes.append(pd.read_csv(p))
+                    if self.raw_dirs is None:
+                        dataframes.append(read_raw(p, self.columns, self.time_range, self.codes))
+                    else:
+                        dataframes.append(read_merged(p, self.raw_dirs, self.columns, self.time_range, 
+                                                      self.codes, self.cache_dir))
+                if not self.codes is None:
+                    for df in dataframes: self.codes.align(df)
                 return(pd.concat(dataframes, ignore_index = True))
         else: return(None)
+
+
+class Calendar():
+    '''
+    Table of day-of-week, weekend, and holiday features for a range of dates.
+    The table is built once; lookups for arrays of dates use integer indexing.
+    Dates outside the range are added as needed.
+
+    Args:
+        start_date, end_date (str): First and last dates in date_only format, e.g. a project's date range.
+        country (str): ISO 3166-1 country code for holidays, e.g. 'US'.
+        subdiv (str or Nonetype): Optional state, province, or other subdivision code.
+        weekend (list): Days of the week that count as weekend days, using Beiwe day order (Sunday = 0).
+
+    Attributes:
+        country, subdiv, weekend: Same as args.
+        dates (numpy.ndarray): Dates in the table, with dtype datetime64[D].
+        day_of_week (numpy.ndarray): Day of the week for each date (Sunday = 0).
+        is_weekend (numpy.ndarray): True for weekend days.
+        is_holiday (numpy.ndarray): True for holidays.
+        holiday_name (numpy.ndarray): Name of the holiday, or '' if not a holiday.
+    '''
+    def __init__(self, start_date, end_date, country = 'US', subdiv = None, 
+                 weekend = [0, 6]):
+        self.country = country
+        self.subdiv = subdiv
+        self.weekend = list(weekend)
+        self.build(between_days(start_date, end_date))
+
+    def build(self, dates):
+        '''
+        Compute features for a contiguous array of dates.
+        '''
+        self.dates = dates
+        # 1970-01-01 was a Thursday
+        self.day_of_week = (dates.astype(np.int64) + 4) % 7
+        self.is_weekend = np.isin(self.day_of_week, self.weekend)
+        calendar = get_holidays(self.country, self.subdiv)
+        years = dates.astype('datetime64[Y]').astype(np.int64) + 1970
+        for y in np.unique(years): calendar.get(datetime.date(int(y), 1, 1)) # add years to calendar
+        self.holiday_name = np.full(len(dates), '', dtype = object)
+        if len(dates) > 0:
+            holiday_dates = np.array([d for d in calendar.keys()], dtype = 'datetime64[D]')
+            names = np.array(list(calendar.values()), dtype = object)
+            inside = (holiday_dates >= dates[0]) & (holiday_dates <= dates[-1])
+            self.holiday_name[(holiday_dates[inside] - dates[0]).astype(np.int64)] = names[inside]
+        self.is_holiday = self.holiday_name != ''
+
+    def index(self, dates):
+        '''
+        Get row numbers for an array of dates, extending the table if necessary.
+
+        Args:
+            dates (list, Series or array): Date strings in date_only format, or datetime64 values.
+
+        Returns:
+            i (numpy.ndarray): Row numbers in the table.
+        '''
+        d = np.asarray(dates, dtype = 'datetime64[D]')
+        if len(d) == 0: return(np.array([], dtype = np.int64))
+        first, last = d.min(), d.max()
+        if first < self.dates[0] or last > self.dates[-1]:
+            self.build(np.arange(min(first, self.dates[0]), max(last, self.dates[-1]) + 1, 
+                                 dtype = 'datetime64[D]'))
+        i = (d - self.dates[0]).astype(np.int64)
+        return(i)
+
+    def lookup(self, dates, feature):
+        '''
+        Get a feature for an array of dates.
+
+        Args:
+            dates (list, Series or array): Date strings in date_only format, or datetime64 values.
+            feature (str): 'day_of_week', 'is_weekend', 'is_holiday', or 'holiday_name'.
+
+        Returns:
+            values (numpy.ndarray): Values of the feature for each date.
+        '''
+        i = self.index(dates)
+        values = getattr(self, feature)[i]
+        return(values)
+
+    def features(self, dates = None):
+        '''
+        Get a dataframe of calendar features.
+
+        Args:
+            dates (list, Series, array or Nonetype): Dates to look up.
+                If None, returns the whole table.
+
+        Returns:
+            df (DataFrame): Columns are date, day_of_week, day_name, is_weekend, is_holiday, holiday_name.
+        '''
+        i = np.arange(len(self.dates)) if dates is None else self.index(dates)
+        df = pd.DataFrame(OrderedDict([
+                ('date', np.datetime_as_string(self.dates[i])),
+                ('day_of_week', self.day_of_week[i]),
+                ('day_name', np.array(day_order, dtype = object)[self.day_of_week[i]]),
+                ('is_weekend', self.is_weekend[i]),
+                ('is_holiday', self.is_holiday[i]),
+                ('holiday_name', self.holiday_name[i])]))
+        return(df)
+
+
+class TimezoneTimeline():
+    '''
+    A user's timezone history, as piecewise-constant intervals.
+    Maps UTC timestamps to local days and local times, e.g. for binning data by local day when a user travels.
+
+    Args:
+        starts (list): Millisecond timestamps at which each timezone begins, in order.
+            The first timezone also applies to all earlier times.
+        timezones (list): Timezone names that can be read by pytz.timezone(), one for each start.
+
+    Attributes:
+        starts (numpy.ndarray): Same as args, with dtype int64.
+        timezones (list): Same as args.
+    '''
+    def __init__(self, starts, timezones):
+        if len(starts) != len(timezones) or len(starts) == 0:
+            raise ValueError('Need one or more starts, with one timezone for each start.')
+        self.starts = np.asarray(starts, dtype = np.int64)
+        self.timezones = list(timezones)
+        if (np.diff(self.starts) <= 0).any():
+            raise ValueError('Starts must be strictly increasing.')
+
+    @classmethod
+    def from_observations(cls, timestamps, timezones, min_duration = hour_ms):
+        '''
+        Build a timeline from observed timezones, e.g. one for each GPS fix.
+        Each change of timezone begins at the first observation in the new timezone.
+
+        Args:
+            timestamps (list, Series or array): Millisecond timestamps.
+            timezones (list, Series or array): Timezone names.  None is ignored.
+            min_duration (int): Intervals shorter than this (in milliseconds) are dropped, 
+                e.g. brief changes due to GPS error near a timezone border.
+                
+        Returns:
+            self (TimezoneTimeline)
+        '''
+        t = np.asarray(timestamps, dtype = np.int64)
+        tz = np.asarray(timezones, dtype = object)
+        ok = tz != None
+        t, tz = t[ok], tz[ok]
+        if len(t) == 0:
+            raise ValueError('No observed timezones.')
+        order = np.argsort(t, kind = 'stable')
+        t, tz = t[order], tz[order]
+        # keep the first observation of each run
+        change = np.append(True, tz[1:] != tz[:-1])
+        t, tz = t[change], tz[change]
+        # drop short runs (other than the last), then merge neighbors with the same timezone
+        keep = np.append(np.diff(t) >= min_duration, True)
+        t, tz = t[keep], tz[keep]
+        change = np.append(True, tz[1:] != tz[:-1])
+        t, tz = t[change], tz[change]
+        return(cls(t, list(tz)))
+
+    @classmethod
+    def from_gps(cls, timestamps, latitudes, longitudes, grid = 0.01, min_duration = hour_ms):
+        '''
+        Build a timeline from GPS data.  See helpers.time.get_timezones().
+
+        Args:
+            timestamps, latitudes, longitudes (list, Series or array): Columns from GPS data.
+            grid (float): Grid spacing in degrees for timezone lookups.
+            min_duration (int): See from_observations().
+
+        Returns:
+            self (TimezoneTimeline)
+        '''
+        timezones = get_timezones(latitudes, longitudes, grid = grid)
+        return(cls.from_observations(timestamps, timezones, min_duration))
+
+    def index(self, timestamps):
+        '''
+        Get the interval that each timestamp belongs to.
+        '''
+        t = np.asarray(timestamps, dtype = np.int64)
+        i = np.searchsorted(self.starts, t, side = 'right') - 1
+        np.maximum(i, 0, out = i)
+        return(i)
+
+    def tz_at(self, timestamps):
+        '''
+        Get the timezone name for each timestamp.
+        '''
+        return(np.array(self.timezones, dtype = object)[self.index(timestamps)])
+
+    def local_ms(self, timestamps):
+        '''
+        Convert timestamps to local wall clock times, in milliseconds since 1970-01-01 00:00:00.
+        See helpers.time.to_local_ms().
+        '''
+        t = np.asarray(timestamps, dtype = np.int64)
+        if len(self.timezones) == 1:
+            return(to_local_ms(t, self.timezones[0]))
+        i = self.index(t)
+        local = np.empty(len(t), dtype = np.int64)
+        for j in np.unique(i):
+            rows = i == j
+            local[rows] = to_local_ms(t[rows], self.timezones[j])
+        return(local)
+
+    def local_dates(self, timestamps):
+        '''
+        Get the local date of each timestamp, with dtype datetime64[D].
+        '''
+        return((self.local_ms(timestamps) // day_ms).astype('datetime64[D]'))
+
+    def day_index(self, timestamps, start_date = None):
+        '''
+        Get the local day of each timestamp as an integer, e.g. for grouping rows by local day.
+
+        Args:
+            timestamps (list, Series or array): Millisecond timestamps.
+            start_date (str or Nonetype): Date in date_only format that gets index 0.
+                If None, days are counted from 1970-01-01.
+
+        Returns:
+            days (numpy.ndarray): Integer day indices.
+        '''
+        days = self.local_ms(timestamps) // day_ms
+        if not start_date is None:
+            days -= np.datetime64(start_date, 'D').astype(np.int64)
+        return(days)
+
+    def seconds_of_day(self, timestamps):
+        '''
+        Get the local time of each timestamp, in seconds since local midnight.
+        '''
+        return(self.local_ms(timestamps) % day_ms // 1000)
+
+    def to_dict(self):
+        '''
+        Get a dictionary that can be saved to json.
+        '''
+        return(OrderedDict([('starts', [int(t) for t in self.starts]), 
+                            ('timezones', list(self.timezones))]))
+
+    @classmethod
+    def from_dict(cls, d):
+        '''
+        Create a timeline from a dictionary returned by to_dict().
+        '''
+        return(cls(d['starts'], d['timezones']))
+
+    def save(self, directory, name = 'timezone_timeline'):
+        '''
+        Save timeline to a json file.
+        '''
+        write_json(self.to_dict(), name, directory)
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Load a timeline from a json file created by save().
+        '''
+        return(cls.from_dict(read_json(path)))
+
+    def __eq__(self, other):
+        return(type(self) is type(other) and self.to_dict() == other.to_dict())
@@ -2,16 +2,31 @@
 Functions for processing Beiwe data.
 '''
 import os
+import csv
+import gzip
+import mmap
 import logging
+import tempfile
 import numpy as np
-from pandas import Series, DataFrame
+from pandas import Series, DataFrame, read_csv, concat
+from pandas.util import hash_pandas_object
 from collections import OrderedDict
-from .time import filename_time_format, to_timestamp
+from .time import filename_time_format, to_timestamp, filename_timestamps, hour_ms
 
 
 logger = logging.getLogger(__name__)
 
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# compressed raw Beiwe data files are named <%Y-%m-%d %H_%M_%S>.csv<extension>
+compression_extensions = OrderedDict([('.gz', 'gzip'), ('.zst', 'zstd')])
+
+
 def to_1Darray(x, name = None):
     '''
     Convert list or pandas series to a 1D numpy array.
@@ -29,6 +44,160 @@ def to_1Darray(x, name = None):
         logger.warning('Unable to convert this type to numpy array.')
 
 
+def get_compression(path):
+    '''
+    Identify the compression of a raw Beiwe data file from its extension.
+
+    Args:
+        path (str): Path to a raw Beiwe data file.
+
+    Returns:
+        compression (str or Nonetype): 'gzip', 'zstd', or None for uncompressed files.
+    '''
+    for e in compression_extensions:
+        if path.endswith(e): return(compression_extensions[e])
+    return(None)
+
+
+def strip_compression(name):
+    '''
+    Drop a compression extension from a file name, e.g. '<datetime>.csv.gz' becomes '<datetime>.csv'.
+    '''
+    for e in compression_extensions:
+        if name.endswith(e): return(name[:-len(e)])
+    return(name)
+
+
+def open_raw(path, mode = 'rt'):
+    '''
+    Open a raw Beiwe data file, with streaming decompression if the file is compressed.
+
+    Args:
+        path (str): Path to a raw Beiwe data file.
+        mode (str): 'rt' for text, 'rb' for bytes.
+
+    Returns:
+        f (file object): Use as a context manager or close when finished.
+    '''
+    compression = get_compression(path)
+    if compression == 'gzip':
+        return(gzip.open(path, mode))
+    elif compression == 'zstd':
+        if zstandard is None:
+            raise ImportError('Reading %s requires the zstandard package.' % os.path.basename(path))
+        return(zstandard.open(path, mode))
+    else:
+        return(open(path, mode))
+
+
+def raw_size(path):
+    '''
+    Get the uncompressed size of a raw Beiwe data file.
+    For gzip files, this is read from the gzip trailer, so it is exact only for files under 4 GB.
+    For zstd files, this is read from the frame header when available.
+    Otherwise, returns the size on disk.
+
+    Args:
+        path (str): Path to a raw Beiwe data file.
+
+    Returns:
+        size (int): Size in bytes.
+    '''
+    compression = get_compression(path)
+    size = os.path.getsize(path)
+    try:
+        if compression == 'gzip' and size >= 4:
+            with open(path, 'rb') as f:
+                f.seek(-4, 2)
+                size = int.from_bytes(f.read(4), 'little')
+        elif compression == 'zstd' and not zstandard is None:
+            with open(path, 'rb') as f:
+                temp = zstandard.frame_content_size(f.read(18))
+            if temp >= 0: size = temp
+    except:
+        logger.warning('Unable to get uncompressed size of %s.' % os.path.basename(path))
+    return(size)
+
+
+def count_rows(path, block_size = 2**24):
+    '''
+    Count rows in a raw Beiwe data file without parsing it.
+    Counts newlines in the memory-mapped file, one block at a time.
+    Compressed files are decompressed as a stream instead.
+    
+    Args:
+        path (str): Path to a raw Beiwe data file with a header.
+        block_size (int): Number of bytes to scan at a time.
+
+    Returns:
+        rows (int): Number of rows, not including the header.
+            A final line without a line break is counted.
+    '''
+    newlines = 0
+    last = b'\n'[0]
+    if not get_compression(path) is None:
+        with open_raw(path, 'rb') as f:
+            while True:
+                block = f.read(block_size)
+                if len(block) == 0: break
+                newlines += block.count(b'\n')
+                last = block[-1]
+    elif os.path.getsize(path) > 0:
+        with open(path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as mm:
+                a = np.frombuffer(mm, dtype = np.uint8)
+                for i in range(0, len(a), block_size):
+                    newlines += int(np.count_nonzero(a[i:i+block_size] == 10))
+                last = a[-1]
+                del a
+    lines = newlines + int(last != 10)
+    rows = max(lines - 1, 0)
+    return(rows)
+
+
+def check_raw(path, headers = None, tail_bytes = 4096):
+    '''
+    Look for problems with a raw Beiwe data file without reading the whole file.
+    Reads only the first line and the last few bytes.
+    For compressed files, only the header is checked.
+
+    Args:
+        path (str): Path to a raw Beiwe data file.
+        headers (list or Nonetype): Optional list of expected headers.
+            Each header is a list of column names.
+            If None, the header isn't checked.
+        tail_bytes (int): Number of bytes to read from the end of the file.
+
+    Returns:
+        issues (list): Issues found, if any:
+            'empty file' - The file has zero bytes.
+            'unreadable' - The file can't be opened or decoded.
+            'unknown header' - The first line doesn't match any of headers.
+            'truncated' - The last line has fewer fields than the header.
+    '''
+    issues = []
+    try:
+        if os.path.getsize(path) == 0:
+            return(['empty file'])
+        with open_raw(path) as f:
+            first = f.readline()
+        header = next(csv.reader([first]))
+        if not headers is None and not header in headers:
+            issues.append('unknown header')
+        if get_compression(path) is None:
+            with open(path, 'rb') as f:
+                f.seek(max(os.path.getsize(path) - tail_bytes, 0))
+                tail = f.read().decode('utf-8', errors = 'replace')
+            lines = tail.rstrip('\r\n').split('\n')
+            if len(lines) > 1 or os.path.getsize(path) <= tail_bytes:
+                last = next(csv.reader([lines[-1]]), [])
+                if lines[-1] != first.rstrip('\r\n') and len(last) < len(header):
+                    issues.append('truncated')
+    except:
+        issues.append('unreadable')
+    return(issues)
+
+
 def directory_range(directory):
 	'''
 	Finds the first and last date/time in a directory that contains Beiwe data.  Searches all subdirectories.
@@ -54,10 +223,133 @@ def directory_range(directory):
 	return(first, last)
 
 
+def filter_filepaths(filepaths, time_range, file_span = hour_ms):
+    '''
+    Drop raw Beiwe data files that can't contain observations from a time range.
+    Uses only the timestamps in file names; files aren't opened.
+
+    Args:
+        filepaths (list): Paths to files named using the Beiwe convention.
+        time_range (list): Ordered pair of millisecond timestamps [start, end].
+            Either may be None for a range that is unbounded on that side.
+        file_span (int): Duration covered by each file, in milliseconds.
+
+    Returns:
+        keep (list): Paths to files that overlap [start, end).
+    '''
+    start, end = time_range
+    t = filename_timestamps([os.path.basename(p) for p in filepaths])
+    overlap = np.ones(len(t), dtype = bool)
+    if not start is None: overlap &= t + file_span > start
+    if not end is None: overlap &= t < end
+    keep = [p for p, o in zip(filepaths, overlap) if o]
+    return(keep)
+
+
+def read_raw(path, columns = None, time_range = None, codes = None):
+    '''
+    Read a raw Beiwe data file into a pandas dataframe.
+    Compressed files (.csv.gz, .csv.zst) are decompressed while reading.
+
+    Args:
+        path (str): Path to a raw Beiwe data file.
+        columns (list or Nonetype): Names of columns to read.
+            If None, all columns are read.
+        time_range (list or Nonetype): Optional.
+            Ordered pair of millisecond timestamps [start, end].
+            If not None, keep only rows with start <= timestamp < end.
+            Either may be None for a range that is unbounded on that side.
+        codes (CategoryCodes or Nonetype): Optional.
+            If not None, string columns in codes.columns are read as categoricals
+            with project-wide codes.
+
+    Returns:
+        df (DataFrame): Rows and columns from the file.
+    '''
+    usecols = None
+    if not columns is None:
+        usecols = list(columns)
+        if not time_range is None and not 'timestamp' in usecols:
+            usecols = ['timestamp'] + usecols
+    dtype = None
+    if not codes is None:
+        dtype = dict([(c, 'category') for c in codes.columns])
+    if get_compression(path) == 'zstd':
+        with open_raw(path) as f:
+            df = read_csv(f, usecols = usecols, dtype = dtype)
+    else:
+        df = read_csv(path, usecols = usecols, dtype = dtype, 
+                      compression = get_compression(path))
+    if not time_range is None and len(df) > 0:
+        start, end = time_range
+        t = df['timestamp'].to_numpy()
+        if np.all(t[1:] >= t[:-1]):
+            # binary search on sorted timestamps
+            i = 0 if start is None else np.searchsorted(t, start, side = 'left')
+            j = len(t) if end is None else np.searchsorted(t, end, side = 'left')
+            if i > 0 or j < len(t):
+                df = df.iloc[i:j].reset_index(drop = True)
+        else:
+            keep = np.ones(len(t), dtype = bool)
+            if not start is None: keep &= t >= start
+            if not end is None: keep &= t < end
+            df = df[keep].reset_index(drop = True)
+    if not columns is None and len(usecols) > len(columns):
+        df = df.drop(columns = ['timestamp'])
+    if not codes is None:
+        codes.encode(df)
+    return(df)
+
+
+def merge_order(df, drop_duplicates = True):
+    '''
+    Get the order of rows that sorts a dataframe by timestamp, 
+    for dataframes that are concatenations of sorted chunks, e.g. hourly raw Beiwe data files.
+
+    Sorted runs (typically one per source file) are merged with a stable sort,
+    which detects existing runs and merges them in close to linear time.
+    Duplicate rows are then identified in one pass:  
+    only rows that share a timestamp with a neighbor are hashed and compared.
+
+    Args:
+        df (DataFrame): A pandas dataframe with a 'timestamp' column.
+        drop_duplicates (bool): Leave out extra copies of rows, if any exist.
+
+    Returns:
+        order (numpy.ndarray): Row positions, in order of timestamp.
+    '''
+    t = df['timestamp'].to_numpy()
+    n = len(t)
+    if n > 1 and np.any(t[1:] < t[:-1]):
+        order = np.argsort(t, kind = 'stable')
+        t = t[order]
+    else:
+        order = np.arange(n)
+    if drop_duplicates and n > 1:
+        same = t[1:] == t[:-1]
+        if np.any(same):
+            # rows that share a timestamp with a neighbor
+            tied = np.zeros(n, dtype = bool)
+            tied[1:] |= same
+            tied[:-1] |= same
+            i = np.flatnonzero(tied)
+            # within each group of tied rows, sort by row hash so that copies are adjacent
+            h = hash_pandas_object(df.iloc[order[i]], index = False).to_numpy()
+            by_hash = np.lexsort((h, t[i]))
+            order[i] = order[i][by_hash]
+            hashes = np.zeros(n, dtype = np.uint64)
+            hashes[i] = h[by_hash]
+            duplicate = np.zeros(n, dtype = bool)
+            duplicate[1:] = same & (hashes[1:] == hashes[:-1])
+            order = order[~duplicate]
+    return(order)
+
+
 def clean_dataframe(df, 
                     drop_duplicates = True, 
                     sort = True, 
-                    update_index = True):
+                    update_index = True,
+                    merge = True):
     '''
     Clean up a pandas dataframe.
     
@@ -67,10 +359,31 @@ def clean_dataframe(df,
         sort (bool):  Sort by timestamp.  
             If True, df must have a timestamp column.
         update_index (bool):  Set index to range(len(df)).
+        merge (bool):  If True and sort is True, use merge_order() to sort and drop duplicates.
+            This is much faster when df is a concatenation of already sorted chunks.
+            Rows with the same timestamp may be reordered.
             
     Returns:
         None
     '''
+    if merge and sort and 'timestamp' in df.columns:
+        n = len(df)
+        keep = merge_order(df, drop_duplicates)
+        if len(keep) < n or np.any(keep != np.arange(n)):
+            index = df.index[keep]
+            kept = np.zeros(n, dtype = bool)
+            kept[keep] = True
+            if len(keep) < n:
+                df.index = np.arange(n)
+                df.drop(index = np.flatnonzero(~kept), inplace = True)
+            # positions of kept rows after dropping duplicates
+            take = (np.cumsum(kept) - 1)[keep]
+            for c in df.columns:
+                df[c] = df[c].values.take(take)
+            df.index = index
+        if update_index:
+            df.set_index(np.arange(len(df)), inplace = True)
+        return
     if drop_duplicates:
         df.drop_duplicates(inplace = True)
     if sort:
@@ -82,6 +395,91 @@ def clean_dataframe(df,
         df.set_index(np.arange(len(df)), inplace = True)
 
 
+def find_copies(path, raw_dirs):
+    '''
+    Find all copies of a raw Beiwe data file in a list of raw data directories.
+    Compressed copies (.csv.gz, .csv.zst) are included.
+
+    Args:
+        path (str): Path to a raw data file in one of raw_dirs.
+        raw_dirs (list): Paths to raw data directories.
+
+    Returns:
+        relative (str): Path to the file, relative to its raw data directory, without compression extension.
+        copies (list): Paths to all copies of the file.
+    '''
+    relative = None
+    for d in raw_dirs:
+        if os.path.abspath(path).startswith(os.path.join(os.path.abspath(d), '')):
+            relative = strip_compression(os.path.relpath(path, d))
+            break
+    if relative is None:
+        return(None, [path])
+    copies = []
+    for d in raw_dirs:
+        for e in [''] + list(compression_extensions.keys()):
+            p = os.path.join(d, relative + e)
+            if os.path.isfile(p): copies.append(p)
+    return(relative, copies)
+
+
+def read_merged(path, raw_dirs, columns = None, time_range = None, 
+                codes = None, cache_dir = None):
+    '''
+    Read all copies of a raw Beiwe data file and take the union of their rows.
+    Use when the same hour may have been downloaded to more than one raw data directory,
+    and some copies may be missing rows.
+    Rows are deduplicated with clean_dataframe().
+
+    Args:
+        path (str): Path to a raw data file in one of raw_dirs.
+        raw_dirs (list): Paths to raw data directories.
+        columns, time_range, codes: See read_raw().
+        cache_dir (str or Nonetype): Optional.
+            If not None, merged files are written to cache_dir, using the same directory structure as raw_dirs.
+            If a merged file already exists in cache_dir, it's read instead of the copies.
+
+    Returns:
+        df (DataFrame): Union of rows from all copies, sorted by timestamp.
+    '''
+    relative, copies = find_copies(path, raw_dirs)
+    cached = None
+    if not cache_dir is None and not relative is None:
+        cached = os.path.join(cache_dir, relative)
+        if os.path.isfile(cached):
+            return(read_raw(cached, columns, time_range, codes))
+    if len(copies) <= 1:
+        return(read_raw(path, columns, time_range, codes))
+    # rows are compared on all columns, so projection waits until after merging
+    # copies are encoded while reading, so that values get the same codes as with read_raw()
+    dataframes = [read_raw(p, None, None if cached else time_range, codes) for p in copies]
+    if not codes is None:
+        for d in dataframes: codes.align(d)
+    df = concat(dataframes, ignore_index = True)
+    clean_dataframe(df)
+    if not cached is None:
+        # other threads may be merging files in the same directory
+        os.makedirs(os.path.dirname(cached), exist_ok = True)
+        # write to a temporary file first, so a partial file is never mistaken for a cached copy
+        fd, temp = tempfile.mkstemp(suffix = '.tmp', dir = os.path.dirname(cached))
+        os.close(fd)
+        try:
+            df.to_csv(temp, index = False)
+            os.replace(temp, cached)
+        except:
+            os.remove(temp)
+            raise
+        if not time_range is None:
+            start, end = time_range
+            t = df['timestamp'].to_numpy()
+            i = 0 if start is None else np.searchsorted(t, start, side = 'left')
+            j = len(t) if end is None else np.searchsorted(t, end, side = 'left')
+            df = df.iloc[i:j].reset_index(drop = True)
+    if not columns is None:
+        df = df[[c for c in df.columns if c in columns]]
+    return(df)
+
+
 def summarize_filepath(filepath = None, ndigits = 3, basename_only = False):
     '''
     Get some basic information from a single raw Beiwe data file.
@@ -0,0 +1,155 @@
+'''
+Tools for sharing arrays with worker processes, e.g. when using multiprocessing.Pool.
+Requires Python 3.8 or later.
+'''
+import weakref
+import logging
+import numpy as np
+from pandas import DataFrame
+from collections import OrderedDict
+
+
+logger = logging.getLogger(__name__)
+
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+    logger.warning('Shared memory requires Python 3.8 or later.')
+
+
+def release_blocks(blocks, unlink):
+    '''
+    Close shared memory blocks and optionally unlink (destroy) them.
+
+    Args:
+        blocks (list): List of SharedMemory objects.
+        unlink (bool): If True, also free the memory.
+            Should only be done once, by the process that created the blocks.
+
+    Returns:
+        None
+    '''
+    for b in blocks:
+        try:
+            b.close()
+        except BufferError:
+            logger.warning('Unable to close %s; views of the block still exist.' % b.name)
+        if unlink:
+            try:
+                b.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class SharedArrays():
+    '''
+    Publish 1-D arrays (e.g. timestamps and values from beiwetools readers)
+    to shared memory blocks, so that worker processes can use them without copying.
+
+    In the parent process:
+        sa = SharedArrays.publish(arrays)
+        Pass sa.descriptor to workers.  It's small and can be pickled.
+        Call sa.unlink() when all workers are done, or use sa as a context manager.
+        Blocks are also unlinked when sa is garbage collected or the interpreter exits.
+    In a worker:
+        with SharedArrays.attach(descriptor) as sa:
+            Use sa.arrays, a dictionary of zero-copy numpy views.
+        Views are invalid after the with block.
+
+    Attributes:
+        descriptor (OrderedDict): Keys are array names.
+            Values are tuples (block name, shape, dtype string).
+        arrays (OrderedDict): Keys are array names, values are numpy arrays backed by shared memory.
+        blocks (list): SharedMemory objects.
+        owner (bool): True if this process created the blocks.
+    '''
+    @classmethod
+    def publish(cls, arrays):
+        '''
+        Copy arrays into new shared memory blocks.
+
+        Args:
+            arrays (dict or DataFrame): Keys are names, values are numpy arrays.
+                If a DataFrame, numeric and boolean columns are published.
+                Other columns are skipped.
+
+        Returns:
+            self (SharedArrays)
+        '''
+        if shared_memory is None:
+            raise ImportError('Shared memory requires Python 3.8 or later.')
+        if isinstance(arrays, DataFrame):
+            temp = OrderedDict()
+            for c in arrays.columns:
+                if arrays[c].dtype.kind in 'biuf': temp[c] = arrays[c].to_numpy()
+                else: logger.warning('Skipping column %s with dtype %s.' % (c, arrays[c].dtype))
+            arrays = temp
+        self = cls.__new__(cls)
+        self.owner = True
+        self.descriptor = OrderedDict()
+        self.arrays = OrderedDict()
+        self.blocks = []
+        for k, a in arrays.items():
+            a = np.asarray(a)
+            # shared memory blocks can't have size zero
+            b = shared_memory.SharedMemory(create = True, size = max(a.nbytes, 1))
+            self.blocks.append(b)
+            view = np.ndarray(a.shape, dtype = a.dtype, buffer = b.buf)
+            view[...] = a
+            self.arrays[k] = view
+            self.descriptor[k] = (b.name, a.shape, a.dtype.str)
+        self.finalizer = weakref.finalize(self, release_blocks, list(self.blocks), True)
+        return(self)
+
+    @classmethod
+    def attach(cls, descriptor):
+        '''
+        Attach to blocks created by publish().
+
+        Args:
+            descriptor (OrderedDict): The descriptor attribute of a published SharedArrays object.
+
+        Returns:
+            self (SharedArrays)
+        '''
+        if shared_memory is None:
+            raise ImportError('Shared memory requires Python 3.8 or later.')
+        self = cls.__new__(cls)
+        self.owner = False
+        self.descriptor = descriptor
+        self.arrays = OrderedDict()
+        self.blocks = []
+        for k, (name, shape, dtype) in descriptor.items():
+            try:
+                # Python 3.13+: don't register blocks that this process didn't create
+                b = shared_memory.SharedMemory(name = name, track = False)
+            except TypeError:
+                b = shared_memory.SharedMemory(name = name)
+            self.blocks.append(b)
+            self.arrays[k] = np.ndarray(shape, dtype = np.dtype(dtype), buffer = b.buf)
+        self.finalizer = weakref.finalize(self, release_blocks, list(self.blocks), False)
+        return(self)
+
+    def close(self):
+        '''
+        Release this process's views of the blocks.
+        If this process created the blocks, also unlink them.
+        '''
+        self.arrays = OrderedDict()
+        self.finalizer()
+
+    def unlink(self):
+        '''
+        Same as close().  Use in the parent process to free shared memory.
+        '''
+        if not self.owner:
+            logger.warning('Only the process that published the arrays should unlink them.')
+        self.close()
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
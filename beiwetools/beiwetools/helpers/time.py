@@ -5,6 +5,9 @@ import pytz
 import logging
 import datetime
 import holidays
+import functools
+import numpy as np
+from pandas import DatetimeIndex
 from timezonefinder import TimezoneFinder
 from .time_constants import *
 
@@ -12,10 +15,31 @@ from .time_constants import *
 logger = logging.getLogger(__name__)
 
 
+@functools.lru_cache(maxsize = None)
+def get_holidays(country = 'US', subdiv = None):
+    '''
+    Get a holiday calendar from the holidays package.  
+    Calendars are cached, so each one is only constructed once.
+
+    Args:
+        country (str): ISO 3166-1 country code, e.g. 'US' or 'CA'.
+        subdiv (str or Nonetype): Optional state, province, or other subdivision code, e.g. 'MA'.
+
+    Returns:
+        calendar (holidays.HolidayBase): Dictionary-like object with dates as keys and holiday names as values.
+            Years are added as needed.
+    '''
+    if hasattr(holidays, 'country_holidays'):
+        calendar = holidays.country_holidays(country, subdiv = subdiv)
+    else: # older versions of holidays
+        calendar = holidays.CountryHoliday(country, prov = subdiv, state = subdiv)
+    return(calendar)
+
+
 def is_US_holiday(date, date_format = date_only):
     '''
     Identify dates that are US holidays.
-    There is probably a better way to do this with pandas.
+    To check many dates at once, use helpers.classes.Calendar.
     
     Args:
         date (str): Date string.
@@ -24,7 +48,7 @@ def is_US_holiday(date, date_format = date_only):
     Returns:
         is_holiday (bool): True if the date is a US holiday.
     '''    
-    us_holidays = holidays.UnitedStates()
+    us_holidays = get_holidays('US')
     d = datetime.datetime.strptime(date, date_format)
     is_holiday = d in us_holidays
     return(is_holiday)
@@ -57,10 +81,25 @@ def convert_seconds(s):
 	Returns:
 		time (str):  Clock time formatted as '%H:%M'.
 	'''
-	time = to_readable(s*1000, to_format = '%H:%M', to_tz = UTC)
+	time = clock_times[int(s // min_s) % len(clock_times)]
 	return(time)
 
 
+def convert_seconds_array(s):
+	'''
+	Convert many seconds of the day to clock times.
+
+	Args:
+		s (list or array):  Seconds of the day.
+
+	Returns:
+		times (numpy.ndarray):  Clock times formatted as '%H:%M'.
+	'''
+	minutes = np.asarray(s, dtype = np.int64) // min_s % len(clock_times)
+	times = np.array(clock_times, dtype = object)[minutes]
+	return(times)
+
+
 def reformat_datetime(time, from_format, to_format, from_tz = None):
     '''
     Change the format of a data/time string.    
@@ -102,6 +141,46 @@ def to_timestamp(time, from_format, from_tz = UTC):
 	return(ts)
 
 
+def filename_timestamps(names):
+	'''
+	Convert Beiwe filename stems to timestamps, without parsing each name separately.
+	Equivalent to to_timestamp(name, filename_time_format) for each name.
+
+	Args:
+		names (list or array): Strings formatted as filename_time_format, 
+			e.g. '2020-03-08 04_00_00'.  
+			Basenames are also accepted, since only the first 19 characters are used.
+
+	Returns:
+		ts (numpy.ndarray): Millisecond timestamps, dtype int64.
+	'''
+	n = len(names)
+	if n == 0: return(np.array([], dtype = np.int64))
+	try:
+		chars = np.array(names, dtype = 'S19').view(np.uint8).reshape(n, 19)
+	except UnicodeEncodeError:
+		raise ValueError('Filename stems must be ASCII strings.')
+	# fixed-width fields: YYYY-mm-dd HH_MM_SS
+	tens = [0, 2, 5, 8, 11, 14, 17]
+	ones = [1, 3, 6, 9, 12, 15, 18]
+	digits = chars - np.uint8(ord('0')) # non-digits wrap around to values > 9
+	separators = chars[:, [4, 7, 10, 13, 16]] == np.frombuffer(b'-- __', dtype = np.uint8)
+	if not separators.all() or (digits[:, tens + ones] > 9).any():
+		raise ValueError('Filename stems do not match %s.' % filename_time_format)
+	pairs = digits[:, tens].astype(np.int32)*10 + digits[:, ones]
+	year = pairs[:, 0]*100 + pairs[:, 1]
+	month, day, hour, minute, second = pairs[:, 2:].T
+	if ((month < 1) | (month > 12) | (day < 1) | (hour > 23) | (minute > 59) | (second > 59)).any():
+		raise ValueError('Filename stems do not match %s.' % filename_time_format)
+	leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+	if (day > np.array(month_days)[month - 1] + (leap & (month == 2))).any():
+		raise ValueError('Day is out of range for month.')
+	months = ((year - 1970)*12 + month - 1).astype('datetime64[M]')
+	days = months.astype('datetime64[D]') + (day - 1)
+	ts = days.astype(np.int64)*day_ms + hour*hour_ms + minute*min_ms + second*1000
+	return(ts)
+
+
 def to_readable(timestamp, to_format, to_tz):    
 	'''
 	Convert a timestamp to a human-readable string localized to a particular timezone.
@@ -123,7 +202,206 @@ def to_readable(timestamp, to_format, to_tz):
 	return(readable)    
 
 
-def get_timezone(latitude, longitude, try_closest = True):
+@functools.lru_cache(maxsize = None)
+def transition_table(tz):
+    '''
+    Get a timezone's UTC offsets as arrays, for converting many timestamps at once.
+    Tables are cached, so each timezone is only processed once.
+
+    Args:
+        tz (str or timezone from pytz.tzfile): A timezone.
+
+    Returns:
+        transitions (numpy.ndarray): 
+            Millisecond timestamps (int64) at which the UTC offset changes, in order.
+            The first entry is the beginning of the table.
+        offsets (numpy.ndarray): 
+            UTC offset (int64 milliseconds) that begins at each transition.
+        names (list): Timezone abbreviation that begins at each transition, e.g. 'EDT'.
+    '''
+    if type(tz) is str:
+        tz = pytz.timezone(tz)
+    if hasattr(tz, '_utc_transition_times'):
+        transitions = np.array(tz._utc_transition_times, dtype = 'datetime64[ms]').astype(np.int64)
+        offsets = np.array([round(i[0].total_seconds()*1000) for i in tz._transition_info], dtype = np.int64)
+        names = [i[2] for i in tz._transition_info]
+    else: # timezones without daylight savings, e.g. UTC
+        dt = datetime.datetime(2000, 1, 1)
+        transitions = np.array([np.iinfo(np.int64).min], dtype = np.int64)
+        offsets = np.array([round(tz.utcoffset(dt).total_seconds()*1000)], dtype = np.int64)
+        names = [tz.tzname(dt)]
+    return(transitions, offsets, names)
+
+
+def transition_index(timestamps, tz):
+    '''
+    For each timestamp, find the row of the timezone's transition table that applies.
+
+    Args:
+        timestamps (list, Series, or 1-D array): Millisecond timestamps.
+        tz (str or timezone from pytz.tzfile): A timezone.
+
+    Returns:
+        index (numpy.ndarray): Indices into the arrays returned by transition_table(tz).
+    '''
+    transitions = transition_table(tz)[0]
+    t = np.asarray(timestamps, dtype = np.int64)
+    index = np.searchsorted(transitions, t, side = 'right') - 1
+    np.maximum(index, 0, out = index)
+    return(index)
+
+
+def utc_offsets(timestamps, tz):
+    '''
+    Get the UTC offset that applies to each timestamp.
+
+    Args:
+        timestamps (list, Series, or 1-D array): Millisecond timestamps.
+        tz (str or timezone from pytz.tzfile): A timezone.
+
+    Returns:
+        offsets (numpy.ndarray): UTC offsets in milliseconds (int64).
+    '''
+    transitions, offsets = transition_table(tz)[:2]
+    t = np.asarray(timestamps, dtype = np.int64)
+    if len(t) > 1 and (t[1:] >= t[:-1]).all():
+        # sorted timestamps: find the few places where the offset changes
+        cuts = np.searchsorted(t, transitions, side = 'left')
+        cuts[0] = 0
+        counts = np.diff(np.append(cuts, len(t)))
+        return(np.repeat(offsets, counts))
+    return(offsets[transition_index(t, tz)])
+
+
+def to_local_ms(timestamps, tz):
+    '''
+    Shift timestamps by their UTC offsets, so that local wall clock times can be read as if they were UTC.
+
+    Args:
+        timestamps (list, Series, or 1-D array): Millisecond timestamps.
+        tz (str or timezone from pytz.tzfile): A timezone.
+
+    Returns:
+        local_ms (numpy.ndarray): Local wall clock times, in milliseconds since 1970-01-01 00:00:00.
+    '''
+    local_ms = np.asarray(timestamps, dtype = np.int64) + utc_offsets(timestamps, tz)
+    return(local_ms)
+
+
+def to_local_datetimes(timestamps, tz):
+    '''
+    Convert timestamps to local date/times.
+
+    Args:
+        timestamps (list, Series, or 1-D array): Millisecond timestamps.
+        tz (str or timezone from pytz.tzfile): A timezone.
+
+    Returns:
+        local (numpy.ndarray): Local wall clock times with dtype datetime64[ms].
+    '''
+    local = to_local_ms(timestamps, tz).astype('datetime64[ms]')
+    return(local)
+
+
+def to_local_dates(timestamps, tz):
+    '''
+    Get the local date of each timestamp.
+    Use np.datetime_as_string(dates) to get date strings in date_only format.
+
+    Args:
+        timestamps (list, Series, or 1-D array): Millisecond timestamps.
+        tz (str or timezone from pytz.tzfile): A timezone.
+
+    Returns:
+        dates (numpy.ndarray): Local dates with dtype datetime64[D].
+    '''
+    dates = (to_local_ms(timestamps, tz) // day_ms).astype('datetime64[D]')
+    return(dates)
+
+
+def to_local_hours(timestamps, tz):
+    '''
+    Get the local hour of the day of each timestamp.
+
+    Args:
+        timestamps (list, Series, or 1-D array): Millisecond timestamps.
+        tz (str or timezone from pytz.tzfile): A timezone.
+
+    Returns:
+        hours (numpy.ndarray): Integers from 0 to 23.
+    '''
+    hours = to_local_ms(timestamps, tz) % day_ms // hour_ms
+    return(hours)
+
+
+def to_readable_array(timestamps, to_format, to_tz):
+    '''
+    Convert many timestamps to human-readable strings localized to a particular timezone.
+    Same output as to_readable(), for each timestamp.
+
+    Args:
+        timestamps (list, Series, or 1-D array): Millisecond timestamps.
+        to_format (str):  The format of readable, expressed using directives from the datetime package.
+        to_tz (str or timezone from pytz.tzfile):  The timezone of readable.
+
+    Returns:
+        readable (numpy.ndarray): Array of human-readable date/time strings.
+    '''
+    transitions, offsets, names = transition_table(to_tz)
+    index = transition_index(timestamps, to_tz)
+    local = DatetimeIndex(np.asarray(timestamps, dtype = np.int64) + offsets[index], 
+                          dtype = 'datetime64[ms]')
+    if not '%Z' in to_format and not '%z' in to_format:
+        return(np.asarray(local.strftime(to_format), dtype = object))
+    # fill in timezone directives separately for each UTC offset
+    readable = np.empty(len(local), dtype = object)
+    groups, inverse = np.unique(index, return_inverse = True)
+    for i, g in enumerate(groups):
+        rows = np.flatnonzero(inverse == i)
+        seconds = offsets[g] // 1000
+        sign = '-' if seconds < 0 else '+'
+        z = '%s%02d%02d' % (sign, abs(seconds) // hour_s, abs(seconds) % hour_s // min_s)
+        f = to_format.replace('%Z', names[g].replace('%', '%%')).replace('%z', z)
+        readable[rows] = np.asarray(local[rows].strftime(f), dtype = object)
+    return(readable)
+
+
+@functools.lru_cache(maxsize = None)
+def timezone_finder():
+    '''
+    Get a TimezoneFinder instance.
+    Loading timezone polygons is slow, so the same instance is reused for all lookups.
+
+    Returns:
+        tf (TimezoneFinder)
+    '''
+    tf = TimezoneFinder()
+    return(tf)
+
+
+@functools.lru_cache(maxsize = 2**16)
+def grid_timezone(i, j, grid, try_closest = True):
+    '''
+    Get the timezone at a point on a grid of coordinates.  Results are cached.
+
+    Args:
+        i, j (int): Latitude and longitude, in units of grid degrees.
+        grid (float): Grid spacing in degrees.
+        try_closest (bool): See get_timezone().
+
+    Returns:
+        tz (str): Timezone string that can be read by pytz.timezone().       
+    '''
+    latitude, longitude = i*grid, j*grid
+    tf = timezone_finder()
+    tz = tf.timezone_at(lng = longitude, lat = latitude)
+    if tz is None and try_closest and hasattr(tf, 'closest_timezone_at'):
+        logger.warning('No timezone found for %s, %s.  Looking for closest timezone.' % (str(latitude), str(longitude)))
+        tz = tf.closest_timezone_at(lat=latitude, lng=longitude)    
+    return(tz)
+
+
+def get_timezone(latitude, longitude, try_closest = True, grid = 0.001):
     '''
     Get timezone from latitude and longitude.
 
@@ -131,15 +409,43 @@ def get_timezone(latitude, longitude, try_closest = True):
         latitude, longitude (float): Coordinates.
         try_closest (bool): 
             If True and no timezone found, will try to find closest timezone within +/- 1 degree latitude & longitude.
+            Not available in recent versions of timezonefinder, which assign ocean timezones instead.
+        grid (float): Coordinates are rounded to multiples of grid degrees, so that lookups can be cached.
+            The default is about 100 meters.
 
     Returns:
         tz (str): Timezone string that can be read by pytz.timezone().       
     '''    
-    tf = TimezoneFinder()
-    tz = tf.timezone_at(lng = longitude, lat = latitude)
-    if tz is None and try_closest:
-        logger.warning('No timezone found for %s, %s.  Looking for closest timezone.' % (str(latitude), str(longitude)))
-        tz = tf.closest_timezone_at(lat=latitude, lng=longitude)    
+    tz = grid_timezone(int(round(latitude/grid)), int(round(longitude/grid)), grid, try_closest)
+    return(tz)
+
+
+def get_timezones(latitudes, longitudes, try_closest = True, grid = 0.01):
+    '''
+    Get timezones for many coordinates, e.g. all rows of a user's GPS data.
+    Coordinates are rounded to a grid, and each grid point is looked up once.
+
+    Args:
+        latitudes, longitudes (list, Series, or 1-D array): Coordinates.
+        try_closest (bool): See get_timezone().
+        grid (float): Grid spacing in degrees.  The default is about 1 kilometer.
+
+    Returns:
+        tz (numpy.ndarray): Array of timezone strings, one for each row.
+            None for rows with missing coordinates.
+    '''
+    lat = np.asarray(latitudes, dtype = np.float64)
+    lon = np.asarray(longitudes, dtype = np.float64)
+    tz = np.full(len(lat), None, dtype = object)
+    ok = np.isfinite(lat) & np.isfinite(lon)
+    i = np.round(lat[ok]/grid).astype(np.int64)
+    j = np.round(lon[ok]/grid).astype(np.int64)
+    # pack each grid point into one integer key
+    keys = (i << 32) + j
+    unique_keys, first, inverse = np.unique(keys, return_index = True, return_inverse = True)
+    names = np.array([grid_timezone(int(i[k]), int(j[k]), grid, try_closest) for k in first], 
+                     dtype = object)
+    tz[ok] = names[inverse]
     return(tz)
 
 
@@ -174,19 +480,17 @@ def summarize_UTC_range(UTC_range,
     
 def between_days(start_date, end_date):
     '''    
-    Get a list of dates given start and end dates.
+    Get an array of dates given start and end dates.
     
     Args:
         start_date, end_date (str):
             Dates in date_only format.
             
     Returns:
-        date_list (list): List of dates from start_date to end_date, inclusive.        
+        date_array (numpy.ndarray): Dates from start_date to end_date, inclusive, with dtype datetime64[D].
+            Use np.datetime_as_string(date_array) to get a list of date strings.
     '''    
-    d0 = datetime.datetime.strptime(start_date, date_only)    
-    d1 = datetime.datetime.strptime(end_date, date_only)    
-    dt_list = [d0]
-    while dt_list[-1] < d1:
-        dt_list.append(dt_list[-1] + datetime.timedelta(days = 1))
-    date_list = [dt.strftime(date_only) for dt in dt_list]
-    return(date_list)
+    d0 = np.datetime64(start_date, 'D')
+    d1 = np.datetime64(end_date, 'D')
+    date_array = np.arange(d0, d1 + 1, dtype = 'datetime64[D]')
+    return(date_array)
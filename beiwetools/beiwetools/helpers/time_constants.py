@@ -19,6 +19,12 @@ year_ms =  365*day_ms
 time_unit_ms = OrderedDict(zip(['minutes', 'hours', 'days', 'weeks', 'months', 'years'],
                                [min_ms, hour_ms, day_ms, week_ms, month_ms, year_ms]))
 
+# days per month in non-leap years
+month_days = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+
+# clock time for each minute of the day, formatted as '%H:%M'
+clock_times = ['%02d:%02d' % divmod(m, 60) for m in range(day_s // min_s)]
+
 # Beiwe day order
 day_order = ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday']
 
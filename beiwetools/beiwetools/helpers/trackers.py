@@ -5,9 +5,10 @@ import os
 import logging
 import datetime
 import numpy as np
+import pandas as pd
 from collections import OrderedDict
 from .process import to_1Darray
-from .functions import write_json
+from .functions import write_json, read_json
 from .time_constants import local_time_format
 
 
@@ -39,10 +40,10 @@ class SamplingSummary():
         if not start_with is None:
             if len(start_with) != cutoff+1:
                 logging.warning('Array of starting counts is too long or too short.')
-            self.counts = start_with
+            self.counts = np.asarray(start_with).astype(np.int64)
         else:
-            self.counts = np.zeros(self.cutoff+1)
-        self.n = np.sum(self.counts)
+            self.counts = np.zeros(self.cutoff+1, dtype = np.int64)
+        self.n = int(np.sum(self.counts))
         self.track_last = track_last
         self.last = None
         
@@ -62,18 +63,34 @@ class SamplingSummary():
         Returns:
             None
         '''        
-        new = to_1Darray(new, 'timestamp')
-        if len(new) > 0:
+        t = to_1Darray(new, 'timestamp')
+        if len(t) > 0:
+            if not is_sorted:
+                t = np.sort(t)
             if self.track_last:
                 if not self.last is None:
-                    t = np.insert(t, 0, self.last)             
+                    t = np.concatenate([[self.last], t])
                 self.last = t[-1]
-            if not is_sorted:
-                t = np.sort(t, kind = 'heapsort')
             temp = np.diff(t)
-            for i in temp:
-                if i <= self.cutoff:  self.counts[i] += 1
-            self.n = np.sum(self.counts)
+            temp = temp[(temp >= 0) & (temp <= self.cutoff)].astype(np.int64)
+            self.counts += np.bincount(temp, minlength = self.cutoff+1)
+            self.n += len(temp)
+
+    def merge(self, other):
+        '''
+        Add counts from another SamplingSummary, e.g. from a different worker or file.
+        Intersample times between the two summaries' data are not counted.
+        
+        Args:
+            other (SamplingSummary): A summary with the same cutoff.
+            
+        Returns:
+            None
+        '''
+        if other.cutoff != self.cutoff:
+            raise ValueError('Can\'t merge summaries with different cutoffs.')
+        self.counts += other.counts
+        self.n += other.n
 
     def frequency(self, per = 1000):
         '''
@@ -90,7 +107,7 @@ class SamplingSummary():
         if duration == 0:
             return(None)
         else:
-            f = (self.n / duration) * 1000
+            f = (self.n / duration) * per
             return(f)
 
     def save(self, directory, filename = 'intersample_times'):
@@ -104,7 +121,7 @@ class SamplingSummary():
         Returns:
             None
         '''
-        np.savetxt(os.path.join(directory, filename + '.txt'), self.counts)
+        np.savetxt(os.path.join(directory, filename + '.txt'), self.counts, fmt = '%d')
 
 
 class StatsTracker():
@@ -179,37 +196,281 @@ class StatsTracker():
             if isinstance(to_write, (dict, OrderedDict)):
                 write_json(to_write, filename, directory)
             elif isinstance(to_write, np.ndarray):
-                np.savetxt(os.path.join(directory, filename + '.txt'), to_write)
+                fmt = '%d' if to_write.dtype.kind in 'iu' else '%.18e'
+                np.savetxt(os.path.join(directory, filename + '.txt'), to_write, fmt = fmt)
             else: logger.warning('Unable to save this type.')
             
 
 class HistogramTracker(StatsTracker):
     '''
     Given bins, track the histogram of a continuous variable.
+    Bins are half-open intervals [left, right).  
+    Missing values (NaN) and infinite values are counted separately and otherwise ignored.
+
+    Args:
+        name (str): Name of the variable to track.
+        edges (list or array): Optional.  Increasing bin edges.
+            If provided, scale, low, high, and n_bins are ignored.
+        scale (str): 'linear', 'log', or 'adaptive'.
+            'linear': n_bins equal-width bins from low to high.
+            'log': n_bins bins from low to high with equal width on the log scale.  Requires low > 0.
+            'adaptive': Equal-width bins aligned to multiples of the width.
+                The range grows to cover all observations, and the width doubles (merging pairs of bins)
+                whenever more than n_bins bins would be needed.  
+                There are no underflow or overflow counts.
+        low, high (float): Range of bins, for linear and log scales.
+        n_bins (int): Number of bins, or maximum number of bins for the adaptive scale.
+        to_get, to_save (list): See StatsTracker.
+
+    Note:
+        n (int): Number of non-missing observations, including underflow and overflow.
+        missing (int): Number of missing or infinite observations.
+        underflow, overflow (int): Number of observations below the first edge or at/above the last edge.
+        min, max (float): Smallest and largest non-missing observations.
+        counts (numpy.ndarray): Integer count for each bin.
+        edges (numpy.ndarray): Bin edges, one more than the number of bins.
     '''
-    pass            
+    def __init__(self, name = '', edges = None, scale = 'linear', 
+                 low = None, high = None, n_bins = 100,
+                 to_get = ['n', 'underflow', 'overflow'], to_save = ['counts', 'edges']):
+        if not edges is None: 
+            scale = 'fixed'
+            edges = np.asarray(edges, dtype = np.float64)
+        elif scale == 'linear':
+            edges = np.linspace(low, high, n_bins + 1)
+        elif scale == 'log':
+            edges = np.geomspace(low, high, n_bins + 1)
+        elif scale == 'adaptive':
+            edges = np.zeros(1)
+        else:
+            raise ValueError('Unknown scale: %s' % scale)
+        if scale != 'adaptive' and (len(edges) < 2 or (np.diff(edges) <= 0).any()):
+            raise ValueError('Bin edges must be increasing.')
+        self.scale = scale
+        self.n_bins = n_bins
+        # for adaptive bins, the first bin begins at start*width
+        self.width = None
+        self.start = 0
+        super().__init__(name, labels = ['n', 'missing', 'underflow', 'overflow', 
+                                         'min', 'max', 'counts', 'edges'], 
+                               starting_values = [0, 0, 0, 0, None, None, 
+                                                  np.zeros(len(edges) - 1, dtype = np.int64), edges],
+                               to_get = to_get, to_save = to_save)
+
+    def update(self, new):
+        new = to_1Darray(new, self.name)
+        if len(new) > 0:
+            x = np.asarray(new, dtype = np.float64)
+            ok = np.isfinite(x)
+            self.stats['missing'] += int(len(x) - np.sum(ok))
+            x = x[ok]
+            if len(x) == 0: return
+            self.update_range(x.min(), x.max(), len(x))
+            if self.scale == 'adaptive':
+                lo, hi = x.min(), x.max()
+                if self.width is None:
+                    span = hi - lo if hi > lo else max(abs(hi), 1.0)
+                    self.width = 2.0**np.ceil(np.log2(span / self.n_bins))
+                    self.start = int(np.floor(lo / self.width))
+                self.cover(int(np.floor(lo / self.width)), int(np.floor(hi / self.width)) + 1)
+                i = np.floor(x / self.width).astype(np.int64) - self.start
+            else:
+                i = np.searchsorted(self.stats['edges'], x, side = 'right') - 1
+                below, above = i < 0, i >= len(self.stats['counts'])
+                self.stats['underflow'] += int(np.sum(below))
+                self.stats['overflow'] += int(np.sum(above))
+                i = i[~(below | above)]
+            self.stats['counts'] += np.bincount(i, minlength = len(self.stats['counts']))
+
+    def update_range(self, low, high, n):
+        '''
+        Update n, min, and max.
+        '''
+        self.stats['n'] += int(n)
+        if self.stats['min'] is None:
+            self.stats['min'], self.stats['max'] = float(low), float(high)
+        else:
+            self.stats['min'] = min(self.stats['min'], float(low))
+            self.stats['max'] = max(self.stats['max'], float(high))
+
+    def coarsen(self):
+        '''
+        Double the width of adaptive bins by merging pairs of bins.
+        '''
+        counts = self.stats['counts']
+        if self.start % 2 != 0:
+            counts = np.concatenate([[0], counts])
+            self.start -= 1
+        if len(counts) % 2 != 0:
+            counts = np.append(counts, 0)
+        self.stats['counts'] = counts.reshape(-1, 2).sum(axis = 1)
+        self.start //= 2
+        self.width *= 2
+        self.stats['edges'] = (self.start + np.arange(len(self.stats['counts']) + 1)) * self.width
+
+    def cover(self, first, end):
+        '''
+        Extend adaptive bins to cover bins first through end-1 (in units of the current width).
+        Bins are coarsened as needed.
+        '''
+        if len(self.stats['counts']) == 0: self.start = first
+        while max(self.start + len(self.stats['counts']), end) - min(self.start, first) > self.n_bins:
+            self.coarsen()
+            first, end = first // 2, -(-end // 2)
+        new_start = min(self.start, first)
+        new_end = max(self.start + len(self.stats['counts']), end)
+        counts = np.zeros(new_end - new_start, dtype = np.int64)
+        offset = self.start - new_start
+        counts[offset:offset + len(self.stats['counts'])] = self.stats['counts']
+        self.stats['counts'] = counts
+        self.start = new_start
+        self.stats['edges'] = (self.start + np.arange(len(counts) + 1)) * self.width
+
+    def merge(self, other):
+        '''
+        Add counts from another HistogramTracker with the same bins.
+        Adaptive histograms are coarsened to a common width.
+        '''
+        if self.scale != other.scale:
+            raise ValueError('Can\'t merge histograms with different scales.')
+        if self.scale == 'adaptive':
+            if not other.width is None:
+                temp = HistogramTracker(scale = 'adaptive', n_bins = self.n_bins)
+                temp.width, temp.start = other.width, other.start
+                temp.stats['counts'] = other.stats['counts'].copy()
+                if self.width is None: self.width = temp.width
+                while self.width < temp.width: self.coarsen()
+                while temp.width < self.width: temp.coarsen()
+                self.cover(temp.start, temp.start + len(temp.stats['counts']))
+                while temp.width < self.width: temp.coarsen()
+                i = temp.start - self.start
+                self.stats['counts'][i:i + len(temp.stats['counts'])] += temp.stats['counts']
+        else:
+            if not np.array_equal(self.stats['edges'], other.stats['edges']):
+                raise ValueError('Can\'t merge histograms with different bins.')
+            self.stats['counts'] += other.stats['counts']
+            self.stats['underflow'] += other.stats['underflow']
+            self.stats['overflow'] += other.stats['overflow']
+        self.stats['missing'] += other.stats['missing']
+        if not other.stats['min'] is None:
+            self.update_range(other.stats['min'], other.stats['max'], other.stats['n'])
+
+    def quantile(self, q):
+        '''
+        Approximate quantiles by linear interpolation within bins.
+        The error is at most the width of the bin that contains the quantile.
+        Quantiles that fall in the underflow or overflow are reported as min or max.
+
+        Args:
+            q (float or array): Probabilities between 0 and 1.
+
+        Returns:
+            x (float or numpy.ndarray): Approximate quantiles.  None if there are no observations.
+        '''
+        if self.stats['n'] == 0: return(None)
+        counts, edges = self.stats['counts'], self.stats['edges']
+        cumulative = np.concatenate([[0], np.cumsum(counts)]) + self.stats['underflow']
+        rank = np.asarray(q, dtype = np.float64) * self.stats['n']
+        i = np.clip(np.searchsorted(cumulative, rank, side = 'right') - 1, 0, len(counts) - 1)
+        within = np.where(counts[i] > 0, (rank - cumulative[i]) / np.maximum(counts[i], 1), 0)
+        x = edges[i] + np.clip(within, 0, 1) * (edges[i + 1] - edges[i])
+        x = np.clip(x, self.stats['min'], self.stats['max'])
+        x = np.where(rank < cumulative[0], self.stats['min'], x)
+        x = np.where(rank > cumulative[-1], self.stats['max'], x)
+        if np.ndim(x) == 0: x = float(x)
+        return(x)
 
 
 class CategoryTracker(StatsTracker):
     '''
     Track levels of a categorical variable.    
+    Each update counts unique values with pandas, then adds them to the running counts.
+    Categories are stored as strings.  Missing values (None or NaN) are counted as 'nan'.
+
+    Args:
+        name (str): Name of the variable to track.
+        max_categories (int or Nonetype): 
+            If None, all categories are counted exactly.
+            Otherwise, at most this many categories are kept, using the Misra-Gries algorithm.
+            Any category with more than n/(max_categories + 1) observations is kept,
+            and each count is an underestimate by at most the value of 'error'.
+        to_get, to_save (list): See StatsTracker.
+
+    Note:
+        unique_categories (int): Number of categories in counts.
+        counts (OrderedDict): Keys are categories, values are counts.
+        n (int): Number of observations.
+        error (int): Maximum undercount of any category.  Always 0 if max_categories is None.
     '''
-    def __init__(self, name = '', 
+    def __init__(self, name = '', max_categories = None,
                  to_get = ['unique_categories'], to_save = ['counts']):    
-        super().__init__(name, labels = ['unique_categories', 'counts'], 
-                               starting_values = [0, OrderedDict({})],
+        super().__init__(name, labels = ['unique_categories', 'counts', 'n', 'error'], 
+                               starting_values = [0, OrderedDict({}), 0, 0],
                                to_get = to_get, to_save = to_save)
+        self.max_categories = max_categories
     
     def update(self, new):
-        new = to_1Darray(new, self.name)
-        if len(new) > 0:
-            for n in new:
-                k = str(n)
-                if k in self.stats['counts'].keys():
-                    self.stats['counts'][k] += 1                
-                else:
-                    self.stats['counts'][k] = 1  
-                    self.stats['unique_categories'] += 1
+        if isinstance(new, pd.DataFrame): values = new[self.name]
+        elif isinstance(new, pd.Series): values = new
+        else: values = pd.Series(to_1Darray(new, self.name))
+        if len(values) > 0:
+            vc = values.value_counts(dropna = False, sort = False)
+            vc = vc[vc > 0] # drop unobserved levels of categoricals
+            self.add(zip([str(k) for k in vc.index], vc.to_numpy().tolist()))
+
+    def add(self, counts):
+        '''
+        Add counts for some categories.
+
+        Args:
+            counts (iterable): Pairs (category, count).
+
+        Returns:
+            None
+        '''
+        c = self.stats['counts']
+        for k, v in counts:
+            if k in c: c[k] += v
+            else: c[k] = v
+            self.stats['n'] += v
+        if not self.max_categories is None and len(c) > self.max_categories:
+            self.prune()
+        self.stats['unique_categories'] = len(self.stats['counts'])
+
+    def prune(self):
+        '''
+        Keep at most max_categories categories.
+        Subtracts the (max_categories + 1)-th largest count from all counts, 
+        then drops categories with counts that are no longer positive.
+        '''
+        c = self.stats['counts']
+        values = np.array(list(c.values()))
+        k = self.max_categories
+        d = int(np.partition(values, len(values) - k - 1)[len(values) - k - 1])
+        self.stats['counts'] = OrderedDict([(key, v - d) for key, v in c.items() if v > d])
+        self.stats['error'] += d
+
+    def merge(self, other):
+        '''
+        Add counts from another CategoryTracker.
+        '''
+        self.stats['error'] += other.stats['error']
+        n = self.stats['n']
+        self.add(other.stats['counts'].items())
+        self.stats['n'] = n + other.stats['n']
+
+    def top(self, k = 10):
+        '''
+        Get the most frequent categories.
+
+        Args:
+            k (int): Number of categories to return.
+
+        Returns:
+            top (list): Pairs (category, count), in decreasing order of count.
+        '''
+        top = sorted(self.stats['counts'].items(), key = lambda kv: -kv[1])[:k]
+        return(top)
 
 
 class RangeTracker(StatsTracker):
@@ -233,11 +494,21 @@ class RangeTracker(StatsTracker):
                 self.stats['min'] = np.min([self.stats['min'], temp_min])
                 self.stats['max'] = np.max([self.stats['max'], temp_max])
 
+    def merge(self, other):
+        '''
+        Combine with the range from another RangeTracker.
+        '''
+        if not other.stats['min'] is None:
+            self.update([other.stats['min'], other.stats['max']])
+
 
 class Welford(StatsTracker):
     '''
     Implementation of Welford's algorithm for online computation of variance.
     From: https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance#Parallel_algorithm
+    Batches of observations are summarized with numpy, then combined with the running
+    statistics using the parallel formula of Chan et al.  
+    Trackers from different workers or files can be combined with merge().
 
     Note:
         n (int): Sample size.
@@ -253,7 +524,39 @@ class Welford(StatsTracker):
     def update(self, new):
         new = to_1Darray(new, self.name)    
         if len(new) > 0:
-            for obs in new: self.update_increment(obs) 
+            x = np.asarray(new, dtype = np.float64)
+            mean = np.mean(x)
+            deviations = x - mean
+            self.combine(len(x), mean, np.dot(deviations, deviations))
+
+    def combine(self, n, mean, sos):
+        '''
+        Combine running statistics with statistics from another sample.
+
+        Args:
+            n (int): Sample size.
+            mean (float): Sample mean.
+            sos (float): Sum of squared deviations from the sample mean.
+
+        Returns:
+            None
+        '''
+        if n == 0: return
+        n_a, mean_a, sos_a = self.stats['n'], self.stats['mean'], self.stats['sos']
+        total = n_a + n
+        delta = mean - mean_a
+        self.stats['n'] = int(total)
+        self.stats['mean'] = float(mean_a + delta * n / total)
+        self.stats['sos'] = float(sos_a + sos + delta**2 * n_a * n / total)
+        if total > 1:
+            self.stats['var'] = self.stats['sos']/(total-1)
+            self.stats['std'] = np.sqrt(self.stats['var'])
+
+    def merge(self, other):
+        '''
+        Combine with statistics from another Welford tracker.
+        '''
+        self.combine(other.stats['n'], other.stats['mean'], other.stats['sos'])
 
     def update_increment(self, obs):
         '''
@@ -270,6 +573,273 @@ class Welford(StatsTracker):
             self.stats['std'] = np.sqrt(self.stats['var'])
     
 
+class QuantileTracker(StatsTracker):
+    '''
+    Online estimation of quantiles with a KLL sketch.
+    From: Karnin, Lang & Liberty (2016), Optimal Quantile Approximation in Streams.
+
+    Observations are kept in a hierarchy of compactors.  An item at level h stands for 2**h observations.
+    When a level is full, it's sorted and every other item (starting at a random offset) is promoted.
+    Memory is about 3*k items, regardless of the number of observations.
+    With the default k = 200, the rank error of any quantile is below 2% 
+    (e.g. the reported median has a true rank between 0.48 and 0.52) with probability above 99%.
+    Error decreases roughly in proportion to 1/k.
+    Sketches from different workers or files can be combined with merge().
+
+    Args:
+        name (str): Name of the variable to track.
+        quantiles (list): Probabilities of quantiles to return with get().
+        k (int): Size of the largest compactor.  Controls accuracy and memory.
+        seed (int): Seed for random offsets, so that results are reproducible.
+        to_get, to_save (list): See StatsTracker.  If to_get is None, n and all quantiles are returned.
+
+    Note:
+        n (int): Number of non-missing observations.
+        min, max (float): Smallest and largest observations.
+        q<percent> (float): Estimated quantiles, e.g. 'q50' for the median.  Updated by get().
+        sketch (OrderedDict): Contents of the sketch, for saving to json.  Updated by save().
+    '''
+    def __init__(self, name = '', quantiles = [0.25, 0.5, 0.75], k = 200, seed = 0,
+                 to_get = None, to_save = ['sketch']):
+        self.quantiles = list(quantiles)
+        self.quantile_labels = ['q%g' % (100*q) for q in self.quantiles]
+        if to_get is None: to_get = ['n'] + self.quantile_labels
+        labels = ['n', 'min', 'max'] + self.quantile_labels + ['sketch']
+        super().__init__(name, labels = labels, 
+                               starting_values = [0, None, None] + [None]*len(self.quantiles) + [None],
+                               to_get = to_get, to_save = to_save)
+        self.k = k
+        self.rng = np.random.default_rng(seed)
+        self.levels = [np.zeros(0)]
+
+    def capacity(self, h):
+        '''
+        Capacity of level h.  Lower levels have geometrically smaller capacities.
+        '''
+        depth = len(self.levels) - 1 - h
+        return(max(2, int(np.ceil(self.k * (2/3)**depth))))
+
+    def compress(self):
+        '''
+        Compact full levels until all levels are within capacity.
+        '''
+        h = 0
+        while h < len(self.levels):
+            level = self.levels[h]
+            if len(level) > self.capacity(h):
+                if h + 1 == len(self.levels): self.levels.append(np.zeros(0))
+                level = np.sort(level)
+                # an odd item stays at this level
+                keep = level[len(level) - len(level) % 2:]
+                pairs = level[:len(level) - len(level) % 2]
+                promoted = pairs[self.rng.integers(2)::2]
+                self.levels[h] = keep
+                self.levels[h + 1] = np.concatenate([self.levels[h + 1], promoted])
+                # capacities depend on the number of levels, so start over
+                h = 0
+            else:
+                h += 1
+
+    def update(self, new):
+        new = to_1Darray(new, self.name)
+        if len(new) > 0:
+            x = np.asarray(new, dtype = np.float64)
+            x = x[~np.isnan(x)]
+            if len(x) == 0: return
+            self.update_range(len(x), x.min(), x.max())
+            self.levels[0] = np.concatenate([self.levels[0], x])
+            self.compress()
+
+    def update_range(self, n, low, high):
+        '''
+        Update n, min, and max.
+        '''
+        self.stats['n'] += int(n)
+        if self.stats['min'] is None:
+            self.stats['min'], self.stats['max'] = float(low), float(high)
+        else:
+            self.stats['min'] = min(self.stats['min'], float(low))
+            self.stats['max'] = max(self.stats['max'], float(high))
+
+    def merge(self, other):
+        '''
+        Add observations summarized by another QuantileTracker.
+        '''
+        if other.stats['n'] == 0: return
+        self.update_range(other.stats['n'], other.stats['min'], other.stats['max'])
+        while len(self.levels) < len(other.levels): self.levels.append(np.zeros(0))
+        for h, level in enumerate(other.levels):
+            self.levels[h] = np.concatenate([self.levels[h], level])
+        self.compress()
+
+    def quantile(self, q):
+        '''
+        Estimate quantiles.
+
+        Args:
+            q (float or array): Probabilities between 0 and 1.
+
+        Returns:
+            x (float or numpy.ndarray): Estimated quantiles.  None if there are no observations.
+        '''
+        if self.stats['n'] == 0: return(None)
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2**h, dtype = np.int64) 
+                                  for h, level in enumerate(self.levels)])
+        order = np.argsort(items, kind = 'stable')
+        items, cumulative = items[order], np.cumsum(weights[order])
+        rank = np.asarray(q, dtype = np.float64) * cumulative[-1]
+        i = np.minimum(np.searchsorted(cumulative, rank, side = 'left'), len(items) - 1)
+        x = items[i]
+        # the extremes are known exactly
+        x = np.where(np.asarray(q) <= 0, self.stats['min'], x)
+        x = np.where(np.asarray(q) >= 1, self.stats['max'], x)
+        if np.ndim(x) == 0: x = float(x)
+        return(x)
+
+    def get(self):
+        if self.stats['n'] > 0:
+            for label, x in zip(self.quantile_labels, self.quantile(self.quantiles)):
+                self.stats[label] = float(x)
+        return(super().get())
+
+    def save(self, directory):
+        self.stats['sketch'] = OrderedDict([('k', self.k), 
+                                            ('n', self.stats['n']),
+                                            ('min', self.stats['min']),
+                                            ('max', self.stats['max']),
+                                            ('levels', [level.tolist() for level in self.levels])])
+        super().save(directory)
+
+    @classmethod
+    def load(cls, path, name = '', quantiles = [0.25, 0.5, 0.75], seed = 0):
+        '''
+        Load a sketch saved by save().  Quantiles can be estimated,
+        and the tracker can be merged or updated.
+        '''
+        sketch = read_json(path)
+        self = cls(name, quantiles = quantiles, k = sketch['k'], seed = seed)
+        self.levels = [np.array(level, dtype = np.float64) for level in sketch['levels']]
+        if sketch['n'] > 0:
+            self.update_range(sketch['n'], sketch['min'], sketch['max'])
+        return(self)
+
+
+def bit_length(x):
+    '''
+    Number of bits needed to represent each element of an array of unsigned 64-bit integers.
+    '''
+    x = np.asarray(x, dtype = np.uint64)
+    high = (x >> np.uint64(32)).astype(np.float64)
+    low = (x & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    # frexp is exact for integers below 2**53
+    return(np.where(high > 0, np.frexp(high)[1] + 32, np.frexp(low)[1]))
+
+
+class DistinctTracker(StatsTracker):
+    '''
+    Online estimation of the number of distinct values with HyperLogLog.
+    From: Flajolet et al. (2007), HyperLogLog: the analysis of a near-optimal cardinality estimation algorithm.
+
+    Values are hashed to 64 bits with pandas.  The first p bits choose one of 2**p registers,
+    and each register keeps the largest number of leading zeros seen in the remaining bits.
+    State is 2**p bytes, e.g. 4 KB for p = 12, regardless of the number of values.
+    The relative standard error of the estimate is about 1.04/sqrt(2**p), e.g. 1.6% for p = 12.
+    Trackers for different days, users, or workers can be combined with merge(),
+    which gives the number of distinct values in the union.
+
+    Args:
+        name (str): Name of the variable to track, e.g. a column of hashed MAC addresses.
+        p (int): Number of bits for choosing registers, from 4 to 18.
+        to_get, to_save (list): See StatsTracker.
+
+    Note:
+        n (int): Number of non-missing observations.
+        distinct (float): Estimated number of distinct values.  Updated by get().
+        registers (numpy.ndarray): The HyperLogLog registers (uint8).
+    '''
+    def __init__(self, name = '', p = 12, to_get = ['distinct'], to_save = ['registers']):
+        if not 4 <= p <= 18:
+            raise ValueError('p must be between 4 and 18.')
+        self.p = p
+        super().__init__(name, labels = ['n', 'distinct', 'registers'], 
+                               starting_values = [0, 0, np.zeros(2**p, dtype = np.uint8)],
+                               to_get = to_get, to_save = to_save)
+
+    def update(self, new):
+        if isinstance(new, pd.DataFrame): values = new[self.name]
+        elif isinstance(new, pd.Series): values = new
+        else: values = pd.Series(to_1Darray(new, self.name))
+        values = values[values.notna()]
+        if len(values) > 0:
+            self.stats['n'] += len(values)
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                # hash each category once
+                h = pd.util.hash_array(values.cat.categories.to_numpy())[values.cat.codes.to_numpy()]
+            else:
+                h = pd.util.hash_array(values.to_numpy(), categorize = False)
+            self.add_hashes(h)
+
+    def add_hashes(self, h):
+        '''
+        Update registers with 64-bit hashes.
+        '''
+        q = 64 - self.p
+        index = (h >> np.uint64(q)).astype(np.int64)
+        rest = h & np.uint64(2**q - 1)
+        rank = (q - bit_length(rest) + 1).astype(np.uint8)
+        np.maximum.at(self.stats['registers'], index, rank)
+
+    def merge(self, other):
+        '''
+        Combine with another DistinctTracker, to estimate distinct values in the union.
+        '''
+        if other.p != self.p:
+            raise ValueError('Can\'t merge trackers with different numbers of registers.')
+        np.maximum(self.stats['registers'], other.stats['registers'], out = self.stats['registers'])
+        self.stats['n'] += other.stats['n']
+
+    def estimate(self):
+        '''
+        Estimate the number of distinct values.
+        Uses linear counting when the estimate is small.
+        '''
+        registers = self.stats['registers']
+        m = len(registers)
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213/(1 + 1.079/m))
+        e = alpha * m**2 / np.sum(np.exp2(-registers.astype(np.float64)))
+        zeros = np.sum(registers == 0)
+        if e <= 2.5*m and zeros > 0:
+            e = m * np.log(m / zeros)
+        return(float(e))
+
+    def get(self):
+        self.stats['distinct'] = self.estimate()
+        return(super().get())
+
+    def save(self, directory):
+        '''
+        Save registers in numpy's binary format, which is about 2**p bytes.
+        '''
+        for s in self.to_save:
+            if len(self.name) > 0: filename = self.name + '_' + s
+            else: filename = s
+            if s == 'registers':
+                np.save(os.path.join(directory, filename + '.npy'), self.stats['registers'])
+            else: logger.warning('Unable to save %s.' % s)
+
+    @classmethod
+    def load(cls, path, name = ''):
+        '''
+        Load registers saved by save().  The number of distinct values can be estimated,
+        and the tracker can be merged or updated, but n is not saved.
+        '''
+        registers = np.load(path)
+        self = cls(name, p = int(np.log2(len(registers))))
+        self.stats['registers'] = registers.astype(np.uint8)
+        return(self)
+
+
 #
 #class CategoryTracker():
 #    '''
@@ -440,4 +1010,105 @@ trackers = OrderedDict([('SamplingSummary', SamplingSummary),
                         ('HistogramTracker', HistogramTracker),
                         ('CategoryTracker', CategoryTracker),
                         ('RangeTracker', RangeTracker),
-                        ('Welford', Welford)])
\ No newline at end of file
+                        ('Welford', Welford),
+                        ('QuantileTracker', QuantileTracker),
+                        ('DistinctTracker', DistinctTracker)])
+
+
+class TrackerBank():
+    '''
+    Update several trackers with one pass over each chunk of data.
+    Each column that is needed is extracted once per chunk, then passed to all trackers for that column.
+    Each tracker is labeled <column>_<tracker>, e.g. 'x_Welford', and this label is used as 
+    the tracker's name, so that statistics and files from different trackers don't collide.
+    If a (column, tracker) pair is repeated, later labels get a number, e.g. 'x_HistogramTracker2'.
+
+    Args:
+        config (list): Each item is a tuple (column, tracker) or (column, tracker, kwargs):
+            column (str): Name of a column.
+            tracker (str): A key from trackers, e.g. 'Welford'.
+            kwargs (dict): Optional.  Keyword arguments for the tracker, e.g. {'n_bins': 50}.
+            For SamplingSummary, kwargs must include cutoff.
+
+    Attributes:
+        config (list): Same as args.
+        columns (list): Names of columns that are needed, in order.
+        trackers (list): Pairs (column, tracker object).
+        labels (list): Label for each tracker, in the same order as trackers.
+    '''
+    def __init__(self, config):
+        self.config = [tuple(c) for c in config]
+        self.columns = []
+        self.trackers = []
+        self.labels = []
+        pairs = [c[:2] for c in self.config]
+        for c in self.config:
+            column, name = c[0], c[1]
+            kwargs = c[2] if len(c) > 2 else {}
+            if not name in trackers:
+                raise ValueError('Unknown tracker: %s' % name)
+            label = column + '_' + name
+            repeats = pairs[:len(self.labels)].count((column, name))
+            if repeats > 0: label += str(repeats + 1)
+            if name == 'SamplingSummary':
+                t = trackers[name](**kwargs)
+            else:
+                t = trackers[name](name = label, **kwargs)
+            self.trackers.append((column, t))
+            self.labels.append(label)
+            if not column in self.columns: self.columns.append(column)
+
+    def update(self, new):
+        '''
+        Update all trackers with a chunk of data.
+
+        Args:
+            new (DataFrame): New observations.  Should have all columns in self.columns.
+
+        Returns:
+            None
+        '''
+        values = OrderedDict()
+        for c in self.columns:
+            if not c in new.columns:
+                logger.warning('Column %s not found.' % c)
+                continue
+            # categoricals stay as Series, so trackers can use their codes
+            if isinstance(new[c].dtype, pd.CategoricalDtype): values[c] = new[c]
+            else: values[c] = new[c].to_numpy()
+        for c, t in self.trackers:
+            if c in values: t.update(values[c])
+
+    def merge(self, other):
+        '''
+        Combine with another TrackerBank that has the same configuration.
+        '''
+        if [c[:2] for c in other.config] != [c[:2] for c in self.config]:
+            raise ValueError('Can\'t merge tracker banks with different configurations.')
+        for (c, t), (c_other, t_other) in zip(self.trackers, other.trackers):
+            t.merge(t_other)
+
+    def get(self):
+        '''
+        Get summary statistics from all trackers.
+
+        Returns:
+            to_return (OrderedDict): Keys are <label>_<statistic>, e.g. 'x_Welford_mean'.
+        '''
+        to_return = OrderedDict()
+        for (c, t), label in zip(self.trackers, self.labels):
+            if isinstance(t, SamplingSummary): temp = OrderedDict([(label + '_frequency', t.frequency())])
+            else: temp = t.get()
+            for k in temp:
+                if k in to_return: logger.warning('Overwriting %s.' % k)
+                to_return[k] = temp[k]
+        return(to_return)
+
+    def save(self, directory):
+        '''
+        Save summaries from all trackers to directory.
+        File names begin with each tracker's label.
+        '''
+        for (c, t), label in zip(self.trackers, self.labels):
+            if isinstance(t, SamplingSummary): t.save(directory, label + '_intersample_times')
+            else: t.save(directory)
\ No newline at end of file
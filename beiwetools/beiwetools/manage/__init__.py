@@ -1 +1,2 @@
 from .classes import *
+from .readers import *
@@ -8,8 +8,9 @@ import logging
 from humanize import naturalsize
 from collections import OrderedDict
 
-from beiwetools.helpers.time import summarize_UTC_range, local_now
-from beiwetools.helpers.classes import Summary
+from beiwetools.helpers.time import summarize_UTC_range, local_now, hour_ms
+from beiwetools.helpers.classes import Summary, TimezoneTimeline
+from beiwetools.helpers.process import open_raw
 from beiwetools.helpers.functions import check_same, sort_by, join_lists, coerce_to_dict
 from beiwetools.configread.classes import BeiweConfig
 
@@ -67,6 +68,9 @@ class BeiweProject():
             'unnamed_objects': Object identifiers that don't have default names.
         summary (Summary):  Project overview for printing.
         info (OrderedDict):  Some organized information about the project.
+        timezones (OrderedDict):  
+            Keys are user IDs, values are TimezoneTimeline objects.
+            See update_timezones() and set_timezone().
     '''
     @classmethod
     def create(cls, raw_dirs, user_ids = 'all', 
@@ -127,6 +131,7 @@ class BeiweProject():
         passive = []
         surveys = OrderedDict()
         self.data = OrderedDict()
+        self.timezones = OrderedDict()
         self.lookup['os'] = OrderedDict()                
         flag_labels = ['ignored_users', 'no_registry', 'without_data', 
                        'no_identifiers', 'irregular_directories', 
@@ -345,9 +350,12 @@ class BeiweProject():
         export_manage(self, directory)
         return(directory)
         
-    def assemble(self, streams, user_ids = 'all'):
+    def assemble(self, streams, user_ids = 'all', 
+                 every = None, per_day = None, seed = 0, exclude = None):
         '''
         Get a single dictionary with paths to all users' files for given streams.
+        Optionally, choose a deterministic subsample of hourly passive data files.
+        See UserData.assemble() for details.
         '''
         if user_ids == 'all': have_ids = self.ids
         else: have_ids = [i for i in user_ids if i in self.ids]        
@@ -365,9 +373,80 @@ class BeiweProject():
             else: streams = [streams]
         a = OrderedDict.fromkeys(have_ids)
         for i in a:
-            a[i] = self.data[i].assemble(streams)
+            a[i] = self.data[i].assemble(streams, every, per_day, seed, exclude)
         return(a)        
 
+    def count_rows(self, user_ids = 'all', n_workers = 8):
+        '''
+        Count rows in every registered file, without parsing.
+        Adds 'rows' and 'n_rows' to each registry entry.  See UserData.count_rows().
+        '''
+        if user_ids == 'all': have_ids = self.ids
+        else: have_ids = [i for i in user_ids if i in self.ids]        
+        entries = join_lists([self.data[i].registry_entries() for i in have_ids])
+        count_registry_rows(entries, n_workers)
+        logger.info('Counted rows for %d users.' % len(have_ids))
+
+    def validate(self, user_ids = 'all', n_workers = 16):
+        '''
+        Check every registered file for problems, e.g. empty files, unknown headers, truncated files.
+        Reads only the first line and the last few bytes of each file.
+
+        Args:
+            user_ids (str or list): 'all' or a list of user IDs.
+            n_workers (int): Number of threads.
+
+        Returns:
+            issues (DataFrame): One row for each problem, with columns 'user_id', 'stream', 'file', 'issue'.
+                To skip problem files, pass set(issues.file) to assemble() as exclude.
+        '''
+        if user_ids == 'all': have_ids = self.ids
+        else: have_ids = [i for i in user_ids if i in self.ids]        
+        issues = check_registries(OrderedDict([(i, self.data[i]) for i in have_ids]), n_workers)
+        logger.info('Found %d issues in %d files.' % (len(issues), len(set(issues.file))))
+        return(issues)
+
+    def update_timezones(self, user_ids = 'all', grid = 0.01, 
+                         min_duration = hour_ms, n_workers = 8):
+        '''
+        Build timezone timelines from each user's raw GPS data.
+        Timelines are saved with export(), so they only need to be built once.
+
+        Args:
+            user_ids (str or list): 'all' or a list of user IDs.
+            grid (float): Grid spacing in degrees for timezone lookups.
+            min_duration (int): Shorter timezone intervals are ignored, in milliseconds.
+            n_workers (int): Number of threads for reading files.
+
+        Returns:
+            None
+        '''
+        if user_ids == 'all': have_ids = self.ids
+        else: have_ids = [i for i in user_ids if i in self.ids]        
+        for i in have_ids:
+            filepaths = self.data[i].assemble(['gps'])['gps']
+            timeline = gps_timeline(filepaths, grid, min_duration, n_workers)
+            if timeline is None:
+                logger.warning('No GPS timezones found for %s.' % i)
+            else:
+                self.timezones[i] = timeline
+        logger.info('Updated timezones for %d users.' % len(have_ids))
+
+    def set_timezone(self, user_id, timezone):
+        '''
+        Set a user's timezone timeline by hand.
+
+        Args:
+            user_id (str): A Beiwe user ID.
+            timezone (str or TimezoneTimeline): A timezone name, for users who never change timezones.
+
+        Returns:
+            None
+        '''
+        if isinstance(timezone, str):
+            timezone = TimezoneTimeline([0], [timezone])
+        self.timezones[user_id] = timezone
+
     def settings(self, setting, user_ids = 'all'):
         '''
         Get a dictionary with a configuration setting for each user.
@@ -406,6 +485,7 @@ class UserData():
                 'count': Number of files for this data stream (int).
                 'bytes': Total size of files on disk in bytes (int).                
                 'files': List of all available files for the data stream.
+                'rows', 'n_rows': Row counts, if count_rows() has been called.
         surveys (OrderedDict):  
             Keys are names of survey directories (e.g. 'audio_recordings', 'survey_timings').
             Each value is an ordered dictionary with keys and values:
@@ -568,18 +648,23 @@ class UserData():
         '''
         export_manage(self, directory)
 
-    def assemble(self, streams):
+    def assemble(self, streams, every = None, per_day = None, seed = 0, exclude = None):
         '''
         Get a dictionary with paths to user's files for given streams.
         An item in streams can be a: 
             passive data stream (str), 
             ordered pair(survey type, survey identifier) (tuple).
+        If every or per_day is not None, passive data files are subsampled by hour.
+        See functions.subsample_files() for details.  Survey files are not subsampled.
+        If exclude is not None, paths in exclude are left out, e.g. files with issues from BeiweProject.validate().
         '''
         if isinstance(streams, str): streams = [streams]
         a = OrderedDict()
         for s in streams:
             if isinstance(s, str):
-                if s in self.passive.keys(): a[s] = self.passive[s]['files']
+                if s in self.passive.keys(): 
+                    a[s] = subsample_files(self.passive[s]['files'], every, per_day, 
+                                           seed, key = self.id + '/' + s)
                 else: a[s] = []
             elif isinstance(s, tuple):
                 s_type, sid = s
@@ -587,8 +672,29 @@ class UserData():
                     a[s] = self.surveys[s_type]['ids'][sid]['files']
                 else: a[s] = []
             else: logger.warning('Check stream format; %s is neither a string nor a tuple.' % str(s))
+        if not exclude is None:
+            exclude = set(exclude)
+            for s in a: a[s] = [p for p in a[s] if not p in exclude]
         return(a)   
 
+    def registry_entries(self):
+        '''
+        Get a list of all registry entries for passive data streams and surveys.
+        '''
+        entries = list(self.passive.values())
+        for s_type in self.surveys:
+            entries += list(self.surveys[s_type]['ids'].values())
+        return(entries)
+
+    def count_rows(self, n_workers = 8):
+        '''
+        Count rows in every registered file, without parsing.
+        Adds two keys to each registry entry, next to 'count' and 'bytes':
+            'rows': List of row counts for each file in 'files'.
+            'n_rows': Total number of rows.
+        '''
+        count_registry_rows(self.registry_entries(), n_workers)
+
     def __eq__(self, other):
         return(check_same(self, other, to_check = 'all'))
 
@@ -617,7 +723,7 @@ class DeviceInfo():
         # read identifiers in order of creation
         self.identifiers = OrderedDict()
         for p in paths:
-            f = open(p, 'r')
+            f = open_raw(p)
             lines = list(f)
             f.close()
             keys = lines[0].replace('\n', '').split(',')
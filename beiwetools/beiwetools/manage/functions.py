@@ -2,18 +2,24 @@
 
 '''
 import os
+import zlib
 import logging
+import numpy as np
 import pandas as pd
 
 from humanize import naturalsize
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-from beiwetools.helpers.time import summarize_UTC_range
+from beiwetools.helpers.time import summarize_UTC_range, filename_timestamps, hour_ms
+from beiwetools.helpers.time import get_timezones
+from beiwetools.helpers.process import strip_compression, raw_size, count_rows, check_raw, read_raw
+from beiwetools.helpers.classes import TimezoneTimeline
 from beiwetools.helpers.functions import (sort_by, setup_directories, 
                                           write_json, read_json, 
-                                          setup_csv, write_to_csv)
+                                          setup_csv, write_to_csv, join_lists)
 
-from .headers import info_header
+from .headers import info_header, raw_headers, issues_header
 
 
 logger = logging.getLogger(__name__)
@@ -68,6 +74,8 @@ def merge_contents(data_dirs, UTC_range = None):
     '''
     Helper function for passive_registry and survey_regsitry.
     Discards paths to duplicate files and chooses larger files whenever possible.
+    Compressed and uncompressed copies of a file (e.g. <datetime>.csv and <datetime>.csv.gz) are duplicates.
+    Sizes of compressed files are compared after decompression.
     
     Args:    
         data_dirs (list):  
@@ -81,35 +89,80 @@ def merge_contents(data_dirs, UTC_range = None):
             A list of paths in which no basename is duplicated, sorted in order of basenames.
     '''    
     if isinstance(data_dirs, str): data_dirs = [data_dirs]
-    if len(data_dirs) == 1:
-         d = data_dirs[0]
-         file_names = sorted(os.listdir(d))
-         if not UTC_range is None:
-             start, end = [dt + '.csv' for dt in UTC_range]
-             file_names = [n for n in file_names if n >= start and n <= end]
-         merge = [os.path.join(d, f) for f in file_names]        
-    else:
-        file_dictionary = OrderedDict()
-        for d in data_dirs:
-            for f in os.listdir(d):
-                if f in file_dictionary.keys():
-                    file_dictionary[f].append(d)
-                else:
-                    file_dictionary[f] = [d]
-        if not UTC_range is None:
-            start, end = [dt + '.csv' for dt in UTC_range]
-            file_names = list(file_dictionary.keys())
-            for f in file_names:
-                if f < start or f > end: del file_dictionary[f]
-        for f in file_dictionary.keys():        
-            file_paths = [os.path.join(d, f) for d in file_dictionary[f]]
-            file_sizes = [os.path.getsize(p) for p in file_paths]
+    file_dictionary = OrderedDict()
+    for d in data_dirs:
+        for f in os.listdir(d):
+            k = strip_compression(f)
+            if k in file_dictionary.keys():
+                file_dictionary[k].append(os.path.join(d, f))
+            else:
+                file_dictionary[k] = [os.path.join(d, f)]
+    if not UTC_range is None:
+        start, end = UTC_range
+        file_names = list(file_dictionary.keys())
+        for f in file_names:
+            dt = f.split('.')[0]
+            if dt < start or dt > end: del file_dictionary[f]
+    for f in file_dictionary.keys():        
+        file_paths = file_dictionary[f]
+        if len(file_paths) == 1:
+            file_dictionary[f] = file_paths[0]
+        else:
+            file_sizes = [raw_size(p) for p in file_paths]
             file_dictionary[f] = file_paths[file_sizes.index(max(file_sizes))]
-        # sort values by keys
-        merge = sort_by(list(file_dictionary.values()), list(file_dictionary.keys()))
+    # sort values by keys
+    merge = sort_by(list(file_dictionary.values()), list(file_dictionary.keys()))
     return(merge)
 
 
+def mix_hash(x):
+    '''
+    Deterministic 64-bit hash (the splitmix64 finalizer) of an array of integers.
+    '''
+    x = np.asarray(x).astype(np.uint64)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    x = x ^ (x >> np.uint64(31))
+    return(x)
+
+
+def subsample_files(filepaths, every = None, per_day = None, seed = 0, key = ''):
+    '''
+    Deterministically choose a subset of hourly raw Beiwe data files.
+    Uses only the timestamps in file names; files aren't opened.
+    Hours are chosen with a hash of (seed, key, hour), so the same arguments always choose the same files,
+    and choices don't depend on which other files are available.
+    Hours are chosen at random, not at fixed intervals, so samples don't align with daily cycles.
+    
+    Args:
+        filepaths (list): Paths to hourly files named using the Beiwe convention.
+        every (int or Nonetype): If not None, keep about one in every N hours.
+        per_day (int or Nonetype): If not None, keep at most this many hours per UTC day.
+        seed (int): Change this to draw a different sample.
+        key (str): Usually a user ID and stream, so that different users and streams get different hours.
+
+    Returns:
+        keep (list): Paths to chosen files, in the same order as filepaths.
+    '''
+    if len(filepaths) == 0 or (every is None and per_day is None): 
+        return(list(filepaths))
+    hours = filename_timestamps([os.path.basename(p) for p in filepaths]) // hour_ms
+    salt = mix_hash([zlib.crc32(key.encode()) ^ (seed << 32)])[0]
+    score = mix_hash(hours.astype(np.uint64) ^ salt)
+    chosen = np.ones(len(hours), dtype = bool)
+    if not every is None:
+        chosen &= score % np.uint64(every) == 0
+    if not per_day is None:
+        days = hours // 24
+        order = np.lexsort((score, days))
+        first = np.searchsorted(days[order], days[order], side = 'left')
+        rank = np.empty(len(hours), dtype = np.int64)
+        rank[order] = np.arange(len(hours)) - first
+        chosen &= rank < per_day
+    keep = [filepaths[i] for i in np.flatnonzero(chosen)]
+    return(keep)
+
+
 def get_survey_ids(dirs):
     '''
     Args:
@@ -305,6 +358,109 @@ def survey_registry(user_id, raw_dirs, UTC_range = None):
     return(survey_range, registry, not_registered)
 
 
+def count_registry_rows(entries, n_workers = 8):
+    '''
+    Add row counts to registry entries.  
+    Rows are counted with helpers.process.count_rows(), in parallel across files.
+    
+    Args:
+        entries (list): Registry entries, i.e. ordered dictionaries with keys 'count', 'bytes', 'files'.
+            See passive_registry() and survey_registry().
+        n_workers (int): Number of threads.
+
+    Returns:
+        None.  Adds these keys to each entry:
+            'rows': List of row counts for each file in 'files'.
+            'n_rows': Total number of rows.
+    '''
+    filepaths = join_lists([e['files'] for e in entries])
+    with ThreadPoolExecutor(max_workers = n_workers) as executor:
+        counts = list(executor.map(count_rows, filepaths))
+    i = 0
+    for e in entries:
+        e['rows'] = counts[i:i+len(e['files'])]
+        e['n_rows'] = sum(e['rows'])
+        i += len(e['files'])
+
+
+def check_registries(data, n_workers = 16):
+    '''
+    Look for problems with every registered file, e.g. empty files, unknown headers, truncated files.
+    Files are checked concurrently with helpers.process.check_raw(), 
+    which reads only the first line and the last few bytes of each file.
+    Headers of passive data files are checked against headers.raw_headers.
+
+    Args:
+        data (OrderedDict): Keys are user IDs, values are UserData objects.
+        n_workers (int): Number of threads.
+
+    Returns:
+        issues (DataFrame): One row for each issue, with columns given by headers.issues_header.
+    '''
+    to_check = []
+    for i in data:
+        ud = data[i]
+        for s in ud.passive:
+            for p in ud.passive[s]['files']:
+                to_check.append((i, s, p, raw_headers.get(s)))
+        for s_type in ud.surveys:
+            for sid in ud.surveys[s_type]['ids']:
+                for p in ud.surveys[s_type]['ids'][sid]['files']:
+                    to_check.append((i, s_type + '/' + sid, p, None))
+    with ThreadPoolExecutor(max_workers = n_workers) as executor:
+        results = list(executor.map(lambda c: check_raw(c[2], c[3]), to_check))
+    rows = []
+    for c, r in zip(to_check, results):
+        rows += [[c[0], c[1], c[2], issue] for issue in r]
+    issues = pd.DataFrame(rows, columns = issues_header)
+    return(issues)
+
+
+def file_timezones(path, grid = 0.01):
+    '''
+    Get the timezones observed in a raw GPS file.
+
+    Args:
+        path (str): Path to a raw GPS file.
+        grid (float): Grid spacing in degrees.  See helpers.time.get_timezones().
+
+    Returns:
+        t (numpy.ndarray): Timestamps of the first observation in each run of the same timezone.
+        tz (numpy.ndarray): Corresponding timezone names.
+    '''
+    df = read_raw(path, columns = ['timestamp', 'latitude', 'longitude'])
+    df.sort_values('timestamp', inplace = True, kind = 'stable')
+    t = df['timestamp'].to_numpy(dtype = np.int64)
+    tz = get_timezones(df['latitude'], df['longitude'], grid = grid)
+    ok = tz != None
+    t, tz = t[ok], tz[ok]
+    change = np.append(True, tz[1:] != tz[:-1])
+    return(t[change], tz[change])
+
+
+def gps_timeline(filepaths, grid = 0.01, min_duration = hour_ms, n_workers = 8):
+    '''
+    Build a timezone timeline from a user's raw GPS files.
+
+    Args:
+        filepaths (list): Paths to raw GPS files.
+        grid (float): Grid spacing in degrees for timezone lookups.
+        min_duration (int): Shorter timezone intervals are ignored, in milliseconds.
+        n_workers (int): Number of threads for reading files.
+
+    Returns:
+        timeline (TimezoneTimeline or Nonetype): None if no timezones were found.
+    '''
+    with ThreadPoolExecutor(max_workers = n_workers) as executor:
+        results = list(executor.map(lambda p: file_timezones(p, grid), filepaths))
+    if len(results) == 0: return(None)
+    t = np.concatenate([r[0] for r in results])
+    tz = np.concatenate([r[1] for r in results])
+    if len(t) == 0: return(None)
+    timeline = TimezoneTimeline.from_observations(t, tz, min_duration)
+    return(timeline)
+
+
 def registry_to_text(passive, surveys, first, last, names):
     '''
     Generate a text summary of a passive data and survey registries.
@@ -431,6 +587,8 @@ def export_manage(d, directory):
                            ('lookup', d.lookup),
                            ('flags', d.flags)])
         write_json(out, 'export', recp)
+        timezones = OrderedDict([(i, d.timezones[i].to_dict()) for i in d.timezones])
+        write_json(timezones, 'timezones', recp)
         d.summary.to_file('summary', directory)
     else:        
         logger.warning('This function doesn\'t handle export of %s.' % str(type(d)))
@@ -463,5 +621,11 @@ def load_manage(d, path):
         d.lists = temp['lists']
         d.lookup = temp['lookup']
         d.flags = temp['flags']
+        d.timezones = OrderedDict()
+        timezones = os.path.join(path, 'records', 'timezones.json')
+        if os.path.exists(timezones):
+            temp = read_json(timezones)
+            for i in temp:
+                d.timezones[i] = TimezoneTimeline.from_dict(temp[i])
     else:
         logger.warning('This function doesn\'t handle loading for %s.' % str(type(d)))
\ No newline at end of file
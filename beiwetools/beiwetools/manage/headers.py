@@ -34,4 +34,46 @@ info_header = [
   'os',                 # 'iOS' or 'Android'. May be 'both' if user switched phones.
   'irregular_directories', # Number of top survey directories that contain raw data files.
   'unregistered_files',    # Number of raw data files in top survey directories.
-  ]
\ No newline at end of file
+  ]
+
+categorical_columns = { # string columns with many repeated values, by passive data stream.
+  'app_log':      ['event', 'msg'],
+  'bluetooth':    ['hashed MAC'],
+  'power_state':  ['event'],
+  'reachability': ['event'],
+  'wifi':         ['hashed MAC', 'SSID'] # Only some versions of the Beiwe app record SSIDs.
+  }
+
+
+raw_headers = { # known column names for raw Beiwe passive data files, by stream.
+  # Each value is a list of header variants, e.g. for different phone operating systems.
+  'accelerometer': [['timestamp', 'UTC time', 'accuracy', 'x', 'y', 'z'],
+                    ['timestamp', 'UTC time', 'x', 'y', 'z']],
+  'app_log':       [['timestamp', 'UTC time', 'launchId', 'memory', 'battery', 'event', 'msg', 'd1', 'd2', 'd3', 'd4']],
+  'bluetooth':     [['timestamp', 'UTC time', 'hashed MAC', 'RSSI']],
+  'calls':         [['timestamp', 'UTC time', 'hashed phone number', 'call type', 'duration in seconds']],
+  'devicemotion':  [['timestamp', 'UTC time', 'roll', 'pitch', 'yaw', 
+                     'rotation_rate_x', 'rotation_rate_y', 'rotation_rate_z', 
+                     'gravity_x', 'gravity_y', 'gravity_z', 
+                     'user_accel_x', 'user_accel_y', 'user_accel_z', 
+                     'magnetic_field_calibration_accuracy', 
+                     'magnetic_field_x', 'magnetic_field_y', 'magnetic_field_z']],
+  'gps':           [['timestamp', 'UTC time', 'latitude', 'longitude', 'altitude', 'accuracy']],
+  'gyro':          [['timestamp', 'UTC time', 'accuracy', 'x', 'y', 'z'],
+                    ['timestamp', 'UTC time', 'x', 'y', 'z']],
+  'identifiers':   [identifiers_header],
+  'magnetometer':  [['timestamp', 'UTC time', 'x', 'y', 'z']],
+  'power_state':   [['timestamp', 'UTC time', 'event'],
+                    ['timestamp', 'UTC time', 'event', 'level']],
+  'proximity':     [['timestamp', 'UTC time', 'event']],
+  'reachability':  [['timestamp', 'UTC time', 'event']],
+  'texts':         [['timestamp', 'UTC time', 'hashed phone number', 'sent vs received', 'message length', 'time sent']],
+  'wifi':          [['timestamp', 'UTC time', 'hashed MAC', 'frequency', 'RSSI']]
+  }
+
+issues_header = [
+  'user_id',  # Beiwe user ID.
+  'stream',   # Passive data stream, or survey type and survey identifier separated by '/'.
+  'file',     # Path to the raw data file.
+  'issue'     # One of: 'empty file', 'unreadable', 'unknown header', 'truncated'.
+  ]
@@ -11,7 +11,7 @@ from collections import OrderedDict
 
 from beiwetools.helpers.plot import elapsed_time_axis, plot_timestamps, make_legend
 from beiwetools.helpers.colors import paired_palette
-from beiwetools.helpers.time import to_timestamp, filename_time_format, UTC
+from beiwetools.helpers.time import to_timestamp, filename_timestamps, filename_time_format, UTC
 
 
 logger = logging.getLogger(__name__)
@@ -245,7 +245,7 @@ def user_plot(ax, ud, align, to_plot_passive, to_plot_surveys, palette):
                 tsd[st + '_' + sid] = []
     # convert to timestamps
     for k in tsd:
-        tsd[k] = [to_timestamp(os.path.basename(p).split('.')[0], from_format = filename_time_format) for p in tsd[k]]
+        tsd[k] = list(filename_timestamps([os.path.basename(p) for p in tsd[k]]))
     # get zero
     if align == 'relative':
         zero_at = to_timestamp(ud.first, from_format = filename_time_format)
@@ -0,0 +1,485 @@
+'''Tools for reading raw Beiwe data from UserData registries.
+
+'''
+import os
+import csv
+import logging
+import threading
+import numpy as np
+import pandas as pd
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from beiwetools.helpers.time import filename_timestamps, hour_ms
+from beiwetools.helpers.process import clean_dataframe, open_raw, raw_size, read_raw, read_merged
+from beiwetools.helpers.classes import ReadQueue
+from beiwetools.helpers.functions import setup_directories, write_json, read_json
+
+
+logger = logging.getLogger(__name__)
+
+
+def build_stream_arrays(ud, stream, directory, columns = None):
+    '''
+    Consolidate a user's files from one passive data stream into contiguous arrays on disk.
+    Intended for high-rate streams, e.g. accelerometer, gyro, magnetometer, devicemotion.
+
+    Creates a folder named <user_id>_<stream> that contains:
+        - timestamp.dat:  Millisecond timestamps (int64).
+        - <column>.dat:  One file of float64 values for each column.
+        - index.json:  Column names, dtypes, row count and an hour-offset index.
+    Rows are cleaned and sorted within each raw file.
+    Files are concatenated in the order given by the registry.
+
+    Args:
+        ud (UserData): A user's raw data registry.
+        stream (str): Name of a passive data stream.
+        directory (str): Where to write the folder of arrays.
+        columns (list or Nonetype): Value columns to keep.
+            If None, keeps all numeric columns other than 'timestamp' found in the first non-empty file.
+
+    Returns:
+        path (str): Path to the folder of arrays.
+    '''
+    path = os.path.join(directory, ud.id + '_' + stream)
+    setup_directories(path)
+    filepaths = ud.assemble(stream)[stream]
+    hours = [int(h) for h in filename_timestamps([os.path.basename(p) for p in filepaths])]
+    offsets = []
+    n = 0
+    last = None
+    handles = OrderedDict()
+    if columns is None: usecols = None
+    else: usecols = ['timestamp'] + [c for c in columns if c != 'timestamp']
+    for p in filepaths:
+        df = read_raw(p, usecols)
+        clean_dataframe(df)
+        if columns is None:
+            # dtypes can't be inferred from a header-only file
+            if len(df) == 0:
+                offsets.append(n)
+                continue
+            temp = df.drop(columns = ['timestamp']).select_dtypes('number')
+            columns = list(temp.columns)
+        if len(handles) == 0:
+            for c in ['timestamp'] + columns:
+                handles[c] = open(os.path.join(path, c + '.dat'), 'wb')
+        t = df['timestamp'].to_numpy(dtype = np.int64)
+        if len(t) > 0 and not last is None and t[0] < last:
+            logger.warning('Timestamps overlap previous file: %s' % os.path.basename(p))
+        offsets.append(n)
+        t.tofile(handles['timestamp'])
+        for c in columns:
+            values = pd.to_numeric(df[c], errors = 'coerce').to_numpy(dtype = np.float64)
+            values.tofile(handles[c])
+        if len(t) > 0: last = t[-1]
+        n += len(t)
+    for f in handles.values(): f.close()
+    if columns is None: columns = []
+    index = OrderedDict([('user_id', ud.id),
+                         ('stream', stream),
+                         ('n', n),
+                         ('columns', columns),
+                         ('dtypes', OrderedDict([('timestamp', 'int64')] + [(c, 'float64') for c in columns])),
+                         ('hours', hours),
+                         ('offsets', offsets)])
+    write_json(index, 'index', path)
+    logger.info('Built %s arrays for Beiwe user ID %s.' % (stream, ud.id))
+    return(path)
+
+
+class StreamArrays():
+    '''
+    Read-only access to arrays created with build_stream_arrays().
+    Arrays are memory-mapped, so only the pages touched by a query are read from disk.
+
+    Args:
+        path (str): Path to a folder created by build_stream_arrays().
+
+    Attributes:
+        path (str): Same as args.
+        index (OrderedDict): Contents of index.json.
+        hours (numpy.ndarray): Timestamps corresponding to each raw file's hour.
+        offsets (numpy.ndarray): Row offset for the beginning of each hour, with total row count appended.
+        arrays (OrderedDict): Keys are column names, values are memory-mapped 1-D arrays.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.index = read_json(os.path.join(path, 'index.json'))
+        self.hours = np.array(self.index['hours'], dtype = np.int64)
+        self.offsets = np.array(self.index['offsets'] + [self.index['n']], dtype = np.int64)
+        self.arrays = OrderedDict()
+        for c, dtype in self.index['dtypes'].items():
+            if self.index['n'] > 0:
+                self.arrays[c] = np.memmap(os.path.join(path, c + '.dat'),
+                                           dtype = dtype, mode = 'r',
+                                           shape = (self.index['n'],))
+            else:
+                self.arrays[c] = np.array([], dtype = dtype)
+
+    def __len__(self):
+        return(self.index['n'])
+
+    def locate(self, start = None, end = None):
+        '''
+        Find the rows with start <= timestamp < end.
+        The hour index narrows the search before the binary search on timestamps.
+
+        Args:
+            start, end (int or Nonetype): Millisecond timestamps.
+                If None, the range is unbounded on that side.
+
+        Returns:
+            i, j (int): The rows are [i, j).
+        '''
+        t = self.arrays['timestamp']
+        i, j = 0, len(self)
+        if not start is None:
+            h = max(np.searchsorted(self.hours, start - start % hour_ms, side = 'right') - 1, 0)
+            lo = self.offsets[h]
+            i = lo + np.searchsorted(t[lo:], start, side = 'left')
+        if not end is None:
+            h = np.searchsorted(self.hours, end - end % hour_ms + hour_ms, side = 'left')
+            hi = self.offsets[min(h + 1, len(self.hours))]
+            j = np.searchsorted(t[:hi], end, side = 'left')
+        return(int(i), int(max(i, j)))
+
+    def get(self, start = None, end = None, columns = None):
+        '''
+        Get zero-copy slices of arrays for a time range.
+
+        Args:
+            start, end (int or Nonetype): Millisecond timestamps.  See locate().
+            columns (list or Nonetype): Columns to return.
+                If None, returns all columns.
+
+        Returns:
+            to_return (OrderedDict): Keys are column names, values are memory-mapped slices.
+        '''
+        if columns is None: columns = list(self.arrays.keys())
+        i, j = self.locate(start, end)
+        to_return = OrderedDict()
+        for c in columns:
+            to_return[c] = self.arrays[c][i:j]
+        return(to_return)
+
+
+def window_list(start, end, window_length_ms, offset = 0):
+    '''
+    Get evenly spaced windows that cover a time period.
+    Windows are aligned so that window boundaries are multiples of window_length_ms, plus offset.
+
+    Args:
+        start, end (int): Millisecond timestamps.
+        window_length_ms (int): Window length in milliseconds.
+        offset (int): Shift window boundaries by this many milliseconds.
+            For example, use a UTC offset to align day-long windows with local midnight.
+
+    Returns:
+        windows (list): List of ordered pairs [window start, window end].
+    '''
+    first = start - (start - offset) % window_length_ms
+    starts = np.arange(first, end, window_length_ms)
+    windows = [[int(s), int(s + window_length_ms)] for s in starts]
+    return(windows)
+
+
+class WindowReader():
+    '''
+    Deliver rows from a user's passive data stream, one window at a time.
+    Uses filename timestamps to open only those files that overlap each window.
+    Rows from files that extend past the end of a window are kept for the next window,
+    so no file is read more than once.
+
+    Args:
+        ud (UserData): A user's raw data registry.
+        stream (str): Name of a passive data stream.
+        windows (int or list):
+            If int, a window length in milliseconds.  
+                Windows are generated with window_list() to cover all of the stream's files.
+            If list, ordered pairs of millisecond timestamps [start, end].
+                Each window includes rows with start <= timestamp < end.
+        file_span (int): Duration covered by each raw file, in milliseconds.
+        columns (list or Nonetype): Names of columns to read.
+            If None, all columns are read.  The 'timestamp' column is always read.
+        codes (CategoryCodes or Nonetype): 
+            If not None, string columns in codes.columns are read as categoricals.
+        raw_dirs (list or Nonetype): 
+            If not None, rows from all copies of each file in raw_dirs are merged.
+            See helpers.process.read_merged().
+        cache_dir (str or Nonetype): Optional directory for merged copies of files.
+
+    Attributes:
+        filepaths (list): Paths to the stream's raw files, in order.
+        starts (numpy.ndarray): Timestamps corresponding to the beginning of each file.
+        windows (list): Ordered pairs [start, end], sorted by start.
+        file_span (int): Same as args.
+        columns (list or Nonetype): Columns to read, including 'timestamp'.
+        codes (CategoryCodes or Nonetype): Same as args.
+        raw_dirs (list or Nonetype): Same as args.
+        cache_dir (str or Nonetype): Same as args.
+        next_file (int): Index of the next file to read.
+        next_window (int): Index of the next window to deliver.
+        buffer (DataFrame or Nonetype): Rows that have been read but not yet passed by a window.
+        header (list or Nonetype): Column names for windows that precede the stream's files.
+    '''
+    def __init__(self, ud, stream, windows, file_span = hour_ms, columns = None, codes = None,
+                 raw_dirs = None, cache_dir = None):
+        self.filepaths = ud.assemble(stream)[stream]
+        self.starts = filename_timestamps([os.path.basename(p) for p in self.filepaths])
+        self.file_span = file_span
+        if not columns is None and not 'timestamp' in columns:
+            columns = ['timestamp'] + list(columns)
+        self.columns = columns
+        self.codes = codes
+        self.raw_dirs = raw_dirs
+        self.cache_dir = cache_dir
+        if isinstance(windows, (int, np.integer)):
+            if len(self.starts) > 0:
+                windows = window_list(self.starts[0], self.starts[-1] + file_span, windows)
+            else: windows = []
+        self.windows = sorted([list(w) for w in windows])
+        self.next_file = 0
+        self.next_window = 0
+        self.buffer = None
+        self.header = None
+
+    def empty(self):
+        '''
+        Get a dataframe with no rows and the stream's columns.
+        If needed, column names are read from the first line of the first file.
+        '''
+        if self.header is None:
+            header = []
+            if len(self.filepaths) > 0:
+                try:
+                    with open_raw(self.filepaths[0]) as f:
+                        header = next(csv.reader([f.readline()]), [])
+                except:
+                    logger.warning('Unable to read header: %s' % os.path.basename(self.filepaths[0]))
+            if self.columns is None: self.header = header
+            elif len(header) == 0: self.header = list(self.columns)
+            else: self.header = [c for c in header if c in self.columns]
+        return(pd.DataFrame(columns = self.header))
+
+    def get(self):
+        '''
+        Return the next window.
+
+        Returns:
+            start, end (int): The window's millisecond timestamps.
+            df (DataFrame): Rows with start <= timestamp < end.
+            Returns None if there are no more windows.
+        '''
+        if self.next_window >= len(self.windows): return(None)
+        start, end = self.windows[self.next_window]
+        self.next_window += 1
+        # skip files that end before the window begins
+        while self.next_file < len(self.filepaths) and self.starts[self.next_file] + self.file_span <= start:
+            self.next_file += 1
+        # read files that begin before the window ends
+        dataframes = [] if self.buffer is None else [self.buffer]
+        while self.next_file < len(self.filepaths) and self.starts[self.next_file] < end:
+            p = self.filepaths[self.next_file]
+            if self.raw_dirs is None:
+                df = read_raw(p, self.columns, codes = self.codes)
+            else:
+                df = read_merged(p, self.raw_dirs, self.columns, codes = self.codes, 
+                                 cache_dir = self.cache_dir)
+            clean_dataframe(df)
+            dataframes.append(df)
+            self.next_file += 1
+        if len(dataframes) == 0:
+            return(start, end, self.empty())
+        if len(dataframes) == 1: self.buffer = dataframes[0]
+        else: 
+            if not self.codes is None:
+                for df in dataframes: self.codes.align(df)
+            self.buffer = pd.concat(dataframes, ignore_index = True)
+        # drop rows that precede the window
+        t = self.buffer['timestamp'].to_numpy()
+        i, j = np.searchsorted(t, [start, end], side = 'left')
+        if i > 0: self.buffer = self.buffer.iloc[i:]
+        df = self.buffer.iloc[:j-i].reset_index(drop = True)
+        return(start, end, df)
+
+    def __iter__(self):
+        while True:
+            w = self.get()
+            if w is None: break
+            yield(w)
+
+
+def registry_entry(ud, stream):
+    '''
+    Get the registry entry for a passive data stream or a survey.
+
+    Args:
+        ud (UserData): A user's raw data registry.
+        stream (str or tuple): A passive data stream, or an ordered pair (survey type, survey identifier).
+
+    Returns:
+        entry (OrderedDict): Has keys 'count', 'bytes', 'files'.
+            Returns None if the stream isn't registered.
+    '''
+    try:
+        if isinstance(stream, tuple):
+            s_type, sid = stream
+            return(ud.surveys[s_type]['ids'][sid])
+        else:
+            return(ud.passive[stream])
+    except:
+        return(None)
+
+
+class MemoryBudget():
+    '''
+    Thread-safe record of the number of bytes held by a ReadPipeline.
+
+    Args:
+        limit (int): Maximum number of bytes.
+
+    Attributes:
+        limit (int): Same as args.
+        used (int): Number of bytes currently reserved.
+    '''
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.lock = threading.Lock()
+
+    def fits(self, n):
+        with self.lock:
+            return(self.used + n <= self.limit)
+
+    def acquire(self, n):
+        with self.lock:
+            self.used += n
+
+    def release(self, n):
+        with self.lock:
+            self.used = max(self.used - n, 0)
+
+
+class ReadPipeline():
+    '''
+    Read raw data for many users, in chunks, with a global memory budget.
+    Chunks are read in background threads, in the order given by BeiweProject.assemble().
+    Before a chunk is read, its in-memory size is estimated from uncompressed file sizes.
+    After it is read, the estimate is replaced with the dataframe's actual size.
+    Only one chunk per stream is read until that stream's expansion ratio has been measured.
+    New reads wait while the budget is full (backpressure).
+    A chunk is held against the budget until the next chunk is requested.
+    
+    Note that the budget applies to dataframes held by the pipeline.
+    Peak memory is approximately baseline memory plus memory_budget, 
+    plus the parser's working memory for n_workers simultaneous reads.
+    A single chunk that is larger than the budget is read alone, with a warning.
+
+    Args:
+        bp (BeiweProject): A project with registries of raw data files.
+        streams (str or list): Streams to read.  See BeiweProject.assemble().
+        memory_budget (int): Maximum number of bytes held by dataframes.
+        user_ids (str or list): 'all' or a list of user IDs.
+        chunk_size (int): Number of files per chunk.
+        n_workers (int): Number of threads for reading.
+        expansion (float): Initial estimate of (in-memory size) / (uncompressed size).
+            Estimates are updated for each stream as chunks are read.
+        columns, time_range, codes: Optional arguments for ReadQueue.
+        merge_copies (bool): If True, merge rows from all copies of each file in the project's raw_dirs.
+            See helpers.process.read_merged().
+        cache_dir (str or Nonetype): Optional directory for merged copies of files.
+
+    Attributes:
+        tasks (list): Tuples (user_id, stream, filepaths, uncompressed bytes).
+        budget (MemoryBudget): Record of bytes held by the pipeline.
+        ratios (dict): Keys are streams, values are observed (in-memory size) / (uncompressed size).
+        peak (int): Largest number of bytes held at once.
+        Other attributes: Same as args.
+    '''
+    def __init__(self, bp, streams, memory_budget, user_ids = 'all', 
+                 chunk_size = 1, n_workers = 2, expansion = 4.0,
+                 columns = None, time_range = None, codes = None,
+                 merge_copies = False, cache_dir = None):
+        self.memory_budget = memory_budget
+        self.chunk_size = chunk_size
+        self.n_workers = n_workers
+        self.expansion = expansion
+        self.columns = columns
+        self.time_range = time_range
+        self.codes = codes
+        self.raw_dirs = bp.raw_dirs if merge_copies else None
+        self.cache_dir = cache_dir
+        self.tasks = []
+        assembled = bp.assemble(streams, user_ids)
+        for i in assembled:
+            for s in assembled[i]:
+                filepaths = assembled[i][s]
+                # registry bytes are sizes on disk, which undershoot badly for compressed files
+                for j in range(0, len(filepaths), chunk_size):
+                    chunk = filepaths[j:j+chunk_size]
+                    self.tasks.append((i, s, chunk, sum([raw_size(p) for p in chunk])))
+        self.budget = MemoryBudget(memory_budget)
+        self.ratios = {}
+        self.peak = 0
+
+    def estimate(self, task):
+        '''
+        Estimate the in-memory size of a chunk.
+        '''
+        i, s, chunk, raw_bytes = task
+        return(int(raw_bytes * self.ratios.get(s, self.expansion)))
+
+    def read(self, task):
+        '''
+        Read a chunk.  Called from worker threads.
+        '''
+        i, s, chunk, raw_bytes = task
+        rq = ReadQueue(chunk, chunk_size = len(chunk), 
+                       columns = self.columns, time_range = self.time_range,
+                       codes = self.codes, raw_dirs = self.raw_dirs,
+                       cache_dir = self.cache_dir)
+        df = rq.get()
+        if df is None: df = pd.DataFrame()
+        return(df)
+
+    def __iter__(self):
+        '''
+        Yields:
+            user_id (str), stream (str or tuple), df (DataFrame)
+        '''
+        pending = deque()
+        next_task = 0
+        held = 0
+        with ThreadPoolExecutor(max_workers = self.n_workers) as executor:
+            while next_task < len(self.tasks) or len(pending) > 0:
+                # the consumer is finished with the previous chunk
+                self.budget.release(held)
+                held = 0
+                # schedule reads that fit in the budget
+                while next_task < len(self.tasks) and len(pending) < 2*self.n_workers:
+                    task = self.tasks[next_task]
+                    # wait for a stream's first chunk before trusting estimates for that stream
+                    if not task[1] in self.ratios and any([t[1] == task[1] for t, _, _ in pending]): break
+                    # estimates can be low, so also stop while actual sizes exceed the budget
+                    if self.budget.used > self.budget.limit: break
+                    e = self.estimate(task)
+                    if not self.budget.fits(e):
+                        if len(pending) > 0 or self.budget.used > 0: break
+                        logger.warning('Chunk for %s exceeds the memory budget.' % task[0])
+                    self.budget.acquire(e)
+                    pending.append((task, e, executor.submit(self.read, task)))
+                    next_task += 1
+                task, e, future = pending.popleft()
+                df = future.result()
+                # replace estimate with actual size
+                actual = int(df.memory_usage(deep = True).sum())
+                self.budget.acquire(actual)
+                self.budget.release(e)
+                if task[3] > 0:
+                    r = actual / task[3]
+                    self.ratios[task[1]] = max(r, self.ratios.get(task[1], 0))
+                self.peak = max(self.peak, self.budget.used)
+                held = actual
+                yield(task[0], task[1], df)
+            self.budget.release(held)
@@ -23,5 +23,6 @@ setup(
     license=license,
     packages=find_namespace_packages(include = ['beiwetools.*']),
     package_data = {'': ['*.json']},
-    install_requires = requires
+    install_requires = requires,
+    extras_require = {'zstd': ['zstandard']}
 )